@@ -41,37 +41,43 @@ class StartApp:
         except Exception as e:
             EcMailer.sendMail('Failed to initialize EcLogger', str(e))
 
+        # root logger, fetched once for the rest of the startup sequence
+        l_logger = EcLogger.rootLogger()
+
         try:
             # instantiate the app (and the connection pool within it)
             l_app = EcAppCore()
         except Exception as e:
-            EcLogger.cm_logger.critical('App crashed. Error: {0}'.format(repr(e)))
+            l_logger.critical('App crashed. Error: {0}'.format(repr(e)))
             sys.exit(0)
 
         try:
             # python http server init
             l_httpd = ThreadedHTTPServer(("", EcAppParam.gcm_httpPort), EcRequestHandler)
         except Exception as e:
-            EcLogger.cm_logger.critical('Cannot start server at [{0}:{1}]. Error: {2}-{3}'.format(
+            l_logger.critical('Cannot start server at [{0}:{1}]. Error: {2}-{3}'.format(
                 EcAppParam.gcm_appDomain,
                 EcAppParam.gcm_httpPort,
                 type(e).__name__, repr(e)
             ))
             sys.exit(0)
 
-        EcLogger.rootLogger().info('gcm_appName    : ' + EcAppParam.gcm_appName)
-        EcLogger.rootLogger().info('gcm_appVersion : ' + EcAppParam.gcm_appVersion)
-        EcLogger.rootLogger().info('gcm_appTitle   : ' + EcAppParam.gcm_appTitle)
+        l_logger.info('gcm_appName    : ' + EcAppParam.gcm_appName)
+        l_logger.info('gcm_appVersion : ' + EcAppParam.gcm_appVersion)
+        l_logger.info('gcm_appTitle   : ' + EcAppParam.gcm_appTitle)
 
         # final success message (sends an e-mail message because it is a warning)
-        EcLogger.cm_logger.warning('Server up and running at [{0}:{1}]'
-                                   .format(EcAppParam.gcm_appDomain, str(EcAppParam.gcm_httpPort)))
+        l_logger.warning('Server up and running at [{0}:{1}]'
+                         .format(EcAppParam.gcm_appDomain, str(EcAppParam.gcm_httpPort)))
 
         try:
             # start server main loop
             l_httpd.serve_forever()
         except Exception as e:
-            EcLogger.cm_logger.critical('App crashed. Error: {0}-{1}'.format(type(e).__name__, repr(e)))
+            l_logger.critical('App crashed. Error: {0}-{1}'.format(type(e).__name__, repr(e)))
+
+        # stop the health check thread
+        l_app.stop()
 
 # ---------------------------------------------------- Main section ----------------------------------------------------
 if __name__ == "__main__":
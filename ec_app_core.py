@@ -6,6 +6,10 @@ __author__ = 'fi11222'
 from ec_utilities import *
 
 import threading
+import collections
+import functools
+import hashlib
+import os
 import psutil
 
 class EcAppCore(threading.Thread):
@@ -35,34 +39,18 @@ class EcAppCore(threading.Thread):
             ))
             raise
 
+        # buffer of rows waiting to be written to TB_EC_MSG (see queueMessage() and flushMessages())
+        self.m_msgBuffer = collections.deque()
+
         # Add a record to TB_EC_MSG, thus testing the db connection
+        self.queueMessage('__init__', '{0} v. {1} starting'.format(
+            EcAppParam.gcm_appName,
+            EcAppParam.gcm_appVersion
+        ))
+
         l_conn = self.m_connectionPool.getconn('DB Connection test in EcAppCore.__init__()')
-        l_cursor = l_conn.cursor()
         try:
-            l_cursor.execute("""
-                insert into "TB_EC_MSG"(
-                    "ST_NAME",
-                    "ST_LEVEL",
-                    "ST_MODULE",
-                    "ST_FILENAME",
-                    "ST_FUNCTION",
-                    "N_LINE",
-                    "TX_MSG"
-                )
-                values(%s, %s, %s, %s, %s, %s, %s);
-            """, (
-                'xxx',
-                'XXX',
-                'ec_app_core',
-                './ec_app_core.py',
-                '__init__',
-                0,
-                '{0} v. {1} starting'.format(
-                    EcAppParam.gcm_appName,
-                    EcAppParam.gcm_appVersion
-                )
-            ))
-            l_conn.commit()
+            self.flushMessages(l_conn)
         except psycopg2.IntegrityError as e:
             self.m_logger.warning('TB_EC_MSG insert failure - Integrity error: {0}-{1}'.format(
                 type(e).__name__,
@@ -76,13 +64,18 @@ class EcAppCore(threading.Thread):
             ))
             raise
 
-        l_cursor.close()
         self.m_connectionPool.putconn(l_conn)
         self.m_logger.info('Sucessuful TB_EC_MSG insert - The DB appears to be working')
 
         # health check counter
         self.m_hcCounter = 0
 
+        # connection report file (see run())
+        self.m_connLogPath = EcAppParam.gcm_logFile.replace('.csv', '.all_connections')
+
+        # set by stop() to end the health check thread
+        self.m_stopEvent = threading.Event()
+
         # starts the refresh thread
         self.start()
 
@@ -90,6 +83,32 @@ class EcAppCore(threading.Thread):
     def getConnectionPool(self):
         return self.m_connectionPool
 
+    # ------------------------- TB_EC_MSG buffer -----------------------------------------------------------------------
+    def queueMessage(self, p_function, p_message):
+        """
+        Appends a message row to the `TB_EC_MSG` buffer. Nothing is written to the DB until the next call
+        to :any:`EcAppCore.flushMessages` (performed by the health check thread every 30 s.)
+
+        :param p_function: Name of the function issuing the message.
+        :param p_message: The message text.
+        """
+        self.m_msgBuffer.append(('xxx', 'XXX', 'ec_app_core', './ec_app_core.py', p_function, 0, p_message))
+
+    def flushMessages(self, p_conn):
+        """
+        Writes all buffered message rows to `TB_EC_MSG` in one go (see :any:`EcDbLogHandler.insertRows`)
+
+        :param p_conn: The DB connection to use.
+        """
+        l_rows = []
+        while len(self.m_msgBuffer) > 0:
+            l_rows.append(self.m_msgBuffer.popleft())
+
+        if len(l_rows) == 0:
+            return
+
+        EcDbLogHandler.insertRows(p_conn, l_rows)
+
     #: Main application entry point - App response to an HTTP request
     def getResponse(self, p_requestHandler):
         return '<p style="color:red;">YOU SHOULD NOT BE SEEING THIS - EcAppCore.getResponse()</p>'
@@ -114,13 +133,25 @@ class EcAppCore(threading.Thread):
             l_lang = 'en'
 
         try:
-            l_string = EcAppParam.i18n(l_lang + '-' + p_stringId)
+            l_string = EcAppCore.resolveUserString(l_lang, p_stringId)
         except KeyError:
-            l_string = 'WARNING UI string for key [] not defined - YOU SHOULD NOT BE SEEING THIS'.format(p_stringId)
-            self.m_logger.warning('UI string for key [] not defined'.format(p_stringId))
+            l_string = 'WARNING UI string for key [{0}] not defined - YOU SHOULD NOT BE SEEING THIS'.format(p_stringId)
+            self.m_logger.warning('UI string for key [{0}] not defined'.format(p_stringId))
 
         return l_string
 
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def resolveUserString(p_lang, p_stringId):
+        """
+        Cached access to :any:`EcAppParam.i18n`. Missing keys raise `KeyError` (and are not cached).
+
+        :param p_lang: Two letter language code.
+        :param p_stringId: The key to a UI string
+        :return: The requested string
+        """
+        return EcAppParam.i18n(p_lang + '-' + p_stringId)
+
     # ------------------------- System health test ---------------------------------------------------------------------
     def check_system_health(self):
         """
@@ -128,6 +159,8 @@ class EcAppCore(threading.Thread):
 
         Every tenth time (once in 5 min.) a full recording of system parameters is made through
         `psutil <https://pythonhosted.org/psutil/>`_ and stored in `TB_MSG`.
+
+        The buffered `TB_EC_MSG` rows (if any) are then written through :any:`EcAppCore.flushMessages`.
         """
         l_mem = psutil.virtual_memory()
 
@@ -144,64 +177,67 @@ class EcAppCore(threading.Thread):
             l_swap = psutil.swap_memory()
             l_diskRoot = psutil.disk_usage('/')
             l_net = psutil.net_io_counters()
-            l_processCount = len(psutil.pids())
-
-            # log message in TB_EC_MSG
-            l_conn = psycopg2.connect(
-                host=EcAppParam.gcm_dbServer,
-                database=EcAppParam.gcm_dbDatabase,
-                user=EcAppParam.gcm_dbUser,
-                password=EcAppParam.gcm_dbPassword
-            )
-            l_cursor = l_conn.cursor()
             try:
-                l_cursor.execute("""
-                    insert into "TB_EC_MSG"(
-                        "ST_NAME",
-                        "ST_LEVEL",
-                        "ST_MODULE",
-                        "ST_FILENAME",
-                        "ST_FUNCTION",
-                        "N_LINE",
-                        "TX_MSG"
-                    )
-                    values(%s, %s, %s, %s, %s, %s, %s);
-                """, (
-                    'xxx',
-                    'XXX',
-                    'ec_app_core',
-                    './ec_app_core.py',
-                    'check_system_health',
-                    0,
-                    'MEM: {0}/CPU: {1}/SWAP: {2}/DISK(root): {3}/NET: {4}/PROCESSES: {5}'.format(
-                        l_mem, l_cpu, l_swap, l_diskRoot, l_net, l_processCount
-                    )
+                # counts the numeric entries of /proc without building the list of all PIDs
+                with os.scandir('/proc') as l_procEntries:
+                    l_processCount = sum(1 for l_entry in l_procEntries if l_entry.name.isdigit())
+            except OSError:
+                # no /proc (non-Linux host)
+                l_processCount = len(psutil.pids())
+
+            self.queueMessage('check_system_health',
+                'MEM: {0}/CPU: {1}/SWAP: {2}/DISK(root): {3}/NET: {4}/PROCESSES: {5}'.format(
+                    l_mem, l_cpu, l_swap, l_diskRoot, l_net, l_processCount
                 ))
-                l_conn.commit()
+
+        # write buffered messages (if any) in TB_EC_MSG
+        if len(self.m_msgBuffer) > 0:
+            l_conn = self.m_connectionPool.getconn('EcAppCore.check_system_health()')
+            try:
+                self.flushMessages(l_conn)
             except Exception as e:
                 EcMailer.sendMail('TB_EC_MSG insert failure: {0}-{1}'.format(
                     type(e).__name__,
                     repr(e)
                 ), 'Sent from EcConsoleFormatter')
                 raise
-
-            l_cursor.close()
-            l_conn.close()
+            finally:
+                self.m_connectionPool.putconn(l_conn)
 
         self.m_hcCounter += 1
 
     #: System health check and app monitoring thread
     def run(self):
         self.m_logger.info('System health check thread started ...')
-        while True:
-            # sleeps for 30 seconds
-            time.sleep(30)
 
+        # hash of the last connection report written and day when it was written
+        l_lastReportHash = None
+        l_lastReportDate = None
+        # waits for 30 seconds (or until stop() is called)
+        while not self.m_stopEvent.wait(30):
             # system health check
             self.check_system_health()
 
-            l_fLogName = re.sub('\.csv', '.all_connections', EcAppParam.gcm_logFile)
-            l_fLog = open(l_fLogName, 'w')
-            l_fLog.write(self.m_connectionPool.connectionReport())
-            l_fLog.close()
-
+            # connection report: the file is only rewritten if the report has changed since the last time
+            # (and at least once a day)
+            l_report = self.m_connectionPool.connectionReport(p_timestamp=False)
+            l_reportHash = hashlib.blake2b(l_report.encode(), digest_size=8).digest()
+            l_today = datetime.date.today()
+            if l_reportHash != l_lastReportHash or l_today != l_lastReportDate:
+                l_fd = os.open(self.m_connLogPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    os.write(l_fd, '[{0}] {1}'.format(
+                        datetime.datetime.now(tz=datetime.timezone.utc), l_report).encode())
+                finally:
+                    os.close(l_fd)
+
+                l_lastReportHash = l_reportHash
+                l_lastReportDate = l_today
+
+        self.m_logger.info('System health check thread stopped')
+
+    def stop(self):
+        """
+        Ends the health check thread (immediately if it is waiting, otherwise after the current check)
+        """
+        self.m_stopEvent.set()
@@ -5,155 +5,629 @@ __author__ = 'fi11222'
 
 import logging
 import csv
-import locale
 import datetime
 import sys
 import urllib.request
 import urllib.error
+import os
 import os.path
+import shutil
+import gzip
+import pickle
+import json
+import email.utils
 import re
 import time
 import operator
-from io import StringIO
+import collections
+import itertools
+import heapq
+import concurrent.futures
+import threading
+import hashlib
+import functools
 
 from ec_utilities import EcLogger
 from ec_app_param import EcAppParam
 
 class Browscap:
-    def __init__(self, p_row):
-        self.m_row = p_row
+    """
+    Base class of the rows of :any:`BrowscapCache.m_cacheRows` (and therefore of the results of the
+    `BrowscapCache.idBrowser*` methods): the rows are named tuples, one field per lowercased column name, deriving
+    from this class. Field values are read directly from the tuple (no wrapper object, no `__getattr__` bounce).
+    """
+    __slots__ = ()
 
     def __getattr__(self, p_item):
         """
-        **CAUTION**: may raise a :any:'KeyError' if the attribute is not in the dict
+        Only called for names which are not fields of the row.
+
+        **CAUTION**: raises a :any:'KeyError' if the attribute is not a column of the Browscap file
         """
-        return self.m_row[p_item]
+        raise KeyError(p_item)
 
 class BrowscapCache:
     cm_versionUrl = 'http://browscap.org/version-number'
     cm_fileUrl = 'https://browscap.org/stream?q=BrowsCapCSV'
 
-    def __init__(self, p_pathCsv):
+    #: The Browscap CSV format is fixed (comma separated, double-quote delimited) --> no need to sniff it.
+    #: Can be overridden through the `p_csvDialect` parameter of :any:`BrowscapCache.__init__` should it ever change.
+    cm_csvDialect = csv.excel
+
+    #: Format of the pickled rows and lookup cache indexes (see :any:`BrowscapCache.loadPickle`), part of their key.
+    #: **Must be incremented** whenever the conversion of the rows (:any:`BrowscapCache.rowConverter`,
+    #: :any:`BrowscapCache.replace_defaults`) or the building of the indexes (:any:`BrowscapCache.uaPatternTokens`,
+    #: :any:`BrowscapCache.indexUaPatterns`) changes, so that the files saved by the previous code are not reused.
+    cm_pickleFormat = 1
+
+    #: Columns holding integer values (see :any:`BrowscapCache.rowConverter`)
+    cm_intFeatures = frozenset(['majorver', 'browser_bits', 'platform_bits', 'minorver'])
+    #: Columns holding float values (see :any:`BrowscapCache.rowConverter`)
+    cm_floatFeatures = frozenset(['cssversion', 'aolversion', 'version', 'renderingengine_version',
+                                  'platform_version'])
+    #: Integer columns for which 0 means "use the default value" (see :any:`BrowscapCache.replace_defaults`)
+    cm_intZeroDefaultFeatures = frozenset(['browser_bits', 'platform_bits', 'minorver'])
+    #: Boolean values, once lowercased (see :any:`BrowscapCache.rowConverter`)
+    cm_boolValues = {'true': True, 'false': False}
+
+    # "standard" user agent string of each of the main browsers (see :any:`BrowscapCache.testMainBrowsers`).
+    # Only a yes/no answer is needed from search() --> no leading/trailing `.*` nor optional tail: they add nothing
+    # to the result but make each failed search quadratic in the length of the string.
+    # Mozilla/5.0 (*Windows NT 6.3*Win64? x64**********************) AppleWebKit/* (KHTML* like Gecko) Chrome/50.*Safari/*
+    # Mozilla/5.0 (*Linux*Android?4.2*Nexus 5 Build/***************) AppleWebKit/* (KHTML* like Gecko*) Chrome/55.*Safari/*
+    # Mozilla/5.0 (*Linux*Android?4.1*Ergo Tab Crystal Lite Build/*) AppleWebKit/*(KHTML,*like Gecko) Chrome/55.*Safari/*
+    # Mozilla/5.0 (*Linux x86**************************************) AppleWebKit/* (KHTML,*like Gecko) Chrome/55.*
+    # Mozilla/5.0 (*Linux*Android?5.0******************************)*AppleWebKit/* (KHTML* like Gecko) Chrome/54.*Safari/*
+    # Mozilla/5.0(*Linux*Android?4.4*Fly IQ4409 Quad Build/*) AppleWebKit/*(KHTML* like Gecko) Chrome/54.*Safari/*
+    # Mozilla/5.0 (*Windows NT 10.0*WOW64*) AppleWebKit/* (KHTML* like Gecko) Chrome/*Anonymisiert durch*
+    # Mozilla/5.0 (iPad*CPU iPhone OS 3?0* like Mac OS X*) AppleWebKit/* (KHTML* like Gecko) *CriOS/55.*Safari/*
+    # Mozilla/5.0 (*Linux*Android?4.0*HTC_Sensation Build/*) AppleWebKit/* (KHTML* like Gecko)*CrMo/51.*Safari/*
+    cm_reMainChrome = re.compile(
+        r'Mozilla/5\.0\s?\(.*\).*AppleWebKit/.*\(KHTML.*like\sGecko.*\)\s?(?:Chrome|.*CriOS|.*CrMo)/')
+
+    # Mozilla/5.0 (*Windows NT 5.0; *WOW64*) Gecko* Firefox/46.0*
+    # Mozilla/4.0 (*Windows NT 10.0*WOW64*) Gecko* Firefox/50.0*
+    # Mozilla/5.0 (*Windows NT 6.4*rv:50.0*) Gecko*/
+    # Mozilla/5.0 (Tablet; rv:37.0*)*Gecko*Firefox/37.0*
+    cm_reMainFirefox = re.compile(r'Mozilla/\d\.0\s\(.*\).*Gecko')
+
+    # Mozilla/5.0 (compatible; MSIE 7.0; *Windows NT 6.1*Win64? x64*Trident/4.0*Mozilla/4.0 (compatible; MSIE 6.0*
+    # Mozilla/5.0 (compatible; MSIE 7.*Windows NT 6.0*Trident/6.0*)*
+    cm_reMainIe = re.compile(r'Mozilla/.*\(.*MSIE\s\d+\.')
+
+    # Mozilla/5.0 (*Windows NT 6.2*Win64? x64*) AppleWebKit/* (KHTML, like Gecko)*Chrome/*Safari/*OPR/35.0*
+    # Mozilla/5.0 (*Windows NT 6.2*Win64? x64*) AppleWebKit/* (KHTML, like Gecko)*Chrome/*Safari/*OPR/*
+    # Opera/9.80*(*Windows NT 5.2*)*Version/*
+    # Mozilla/?.*(*Mac OS X 10?10*)*Opera?3.00*
+    # Mozilla/5.0 (compatible; MSIE *Windows NT 6.2*Win64? x64*)*Opera*
+    # --> 'Opera' substring test (see cm_mainBrowsers)
+
+    # Mozilla/5.0 (*Linux*Android?5.0* Build/*) AppleWebKit/* (KHTML, like Gecko) Version/* UCBrowser/10.7* U3/* Safari/*
+    # Mozilla/5.0 (*Linux*Android?2.3*) AppleWebKit/* (KHTML,*like Gecko*) UCBrowser/2.3*Safari/*
+    # Mozilla/5.0 (*CPU iPhone OS 9?0* like Mac OS X*)*AppleWebKit/*(*KHTML* like Gecko*)*UCBrowser/*
+    # --> 'UCBrowser'/'UCWEB' substring tests (see cm_mainBrowsers)
+
+    # Mozilla/5.0*(iPhone*CPU iPhone OS 5?1* like Mac OS X*)*AppleWebKit/*(*KHTML, like Gecko*)*Version/8.1*Safari/*
+    # Mozilla/5.0 (*Mac OS X 10?4*) AppleWebKit/* (KHTML* like Gecko) *Version/3.2* Safari/*
+    # Mozilla/5.0 (*Windows NT 6.2*) AppleWebKit/* (KHTML* like Gecko) *Version/5.0* Safari/*
+    # Mozilla/5.0 (*Linux*x86_64*) AppleWebKit/* (KHTML* like Gecko) *Version/7.1* Safari/*
+    cm_reMainSafari = re.compile(
+        r'Mozilla/\d\.\d.*\(.*\).*AppleWebKit/.*\(.*KHTML.*like\sGecko.*\).*Version/\d+\.\d+.*Safari/')
+
+    #: lowercased browser name --> (literals, standard user agent regex, counter name) (see
+    #: :any:`BrowscapCache.testMainBrowsers`). A user agent is "standard" if it contains one of the literals and
+    #: (if there is one) matches the regex. The literals are a necessary condition for the regex, so the cheap
+    #: substring tests rule out most non-matching strings before the regex engine is involved. Opera and UC
+    #: Browser need no regex at all.
+    cm_mainBrowsers = {
+        'chrome': (('Chrome/', 'CriOS/', 'CrMo/'), cm_reMainChrome, 'chrome'),
+        'firefox': (('Gecko',), cm_reMainFirefox, 'firefox'),
+        'ie': (('MSIE',), cm_reMainIe, 'ie'),
+        'opera': (('Opera',), None, 'opera'),
+        'uc browser': (('UCBrowser', 'UCWEB'), None, 'uc'),
+        'safari': (('Safari/',), cm_reMainSafari, 'safari')
+    }
+
+    #: (browser, literals, regex) tests of :any:`BrowscapCache.idBrowserFastAndDirty`, tried in this order (see
+    #: :any:`BrowscapCache.mainBrowserTest`). The regexes are compiled once, with the class, and each one is only run
+    #: if one of its (necessary) literals is present. Only the truth value of search() matters, so the regexes have
+    #: no leading/trailing `.*` (or optional trailing groups): they cannot change the outcome but make the
+    #: backtracking engine retry them from every start position (quadratic in the length of the string)
+    cm_fastBrowsers = (
+        ('Chrome', ('AppleWebKit/',),
+         re.compile(r'Mozilla/5\.0(\s|)\(.*\).*AppleWebKit/.*\(KHTML.*like\sGecko.*\)(\s|)(Chrome|.*CriOS|.*CrMo)/')),
+        ('UC Browser', ('UCBrowser', 'UCWEB'), None),
+        ('Opera', ('Opera',), None),
+        ('IE', ('MSIE',), re.compile(r'Mozilla/(\d\.0|\.*).*\(.*MSIE\s\d+\.')),
+        ('Safari', ('Safari',), None),
+        ('Safari', ('Mac',), re.compile(r'Mozilla/5\.0(\s|)\(.*Mac\sOS\sX.*\).*AppleWebKit/')),
+        ('Firefox', ('Gecko',), re.compile(r'Mozilla/\d\.0\s\(.*\).*Gecko'))
+    )
+
+    #: Wildcards of the Browscap user agent patterns (see :any:`BrowscapCache.uaPatternLiteral`)
+    cm_reWildcards = re.compile(r'[*?]')
+
+    #: Word tokens of user agent strings and patterns (see :any:`BrowscapCache.indexUaPatterns`)
+    cm_reToken = re.compile(r'\w+')
+
+    #: Number of user agent strings whose identification results are kept by each idBrowser* method (real traffic
+    #: is dominated by a small number of distinct user agents)
+    cm_uaCacheSize = 65536
+
+    #: Browser keywords searched by :any:`BrowscapCache.idBrowserAnalytic` in the part of the (lowercased) user agent
+    #: string following the parenthesised block, in one pass: one group per keyword set, within a lookahead so that
+    #: overlapping keywords are all found. Group number --> (priority rank, browser). Ranks 4 and 8 are the IE
+    #: tests made on the parenthesised block and 0 is also reached through the head of the string.
+    cm_reAnalyticBrowser = re.compile(
+        r'(?=(opera|opr)|(edge)|(fxios)|(ucbrowser)|(chromium)|(chrome|crios|crmo)|(safari)|(firefox)|(gecko))')
+    cm_analyticBrowsers = (None, (0, 'Opera'), (1, 'Edge'), (2, 'Firefox'), (3, 'UC Browser'), (5, 'Chromium'),
+                           (6, 'Chrome'), (7, 'Safari'), (9, 'Firefox'), (10, 'Firefox'))
+
+    #: Platform keywords searched by :any:`BrowscapCache.idBrowserAnalytic` in the (lowercased) parenthesised block,
+    #: in one pass. The groups are in priority order (lowest group number wins). Group number --> platform
+    cm_reAnalyticPlatform = re.compile(
+        r'(?=(android)|(iphone\sos)|(ipad)|(cros)|(windows\snt\s5)|(windows\snt\s6\.0)|(windows\snt\s6\.1)|'
+        r'(windows\snt\s6\.2)|(windows\snt\s6\.3)|(windows\snt\s10)|(windows)|(mac\sos\sx)|(ubuntu)|(linux))')
+    cm_analyticPlatforms = (None, 'Android', 'iOS', 'iOS', 'ChromeOS', 'WinXP', 'WinVista', 'Win7', 'Win8', 'Win8.1',
+                            'Win10', 'Windows', 'MacOSX', 'Ubuntu', 'Linux')
+
+    #: Other :any:`BrowscapCache.idBrowserAnalytic` patterns, compiled once: head/parenthesised block/tail split,
+    #: IE 11, iOS Safari, Facebook app and bots (Darwin and bot patterns apply to the lowercased string)
+    cm_reAnalyticSplit = re.compile(r'((Mozilla|Opera|UCWEB)/\d+\.\d+)(\s|)\(([^\)]*)\)(.*)')
+    cm_reAnalyticTrident = re.compile(r'windows.*trident')
+    cm_reAnalyticDarwin = re.compile(r'safari.*darwin')
+    cm_reAnalyticFacebook = re.compile(r'facebookexternalhit|FBAN|FBAV|FBBV|FBRV|FBDV|FBSN|FBSV|FBSS|FBCR|FBIOS')
+    cm_reAnalyticBot = re.compile(r'bot|spider|crawl|curl|wget|python|phantomjs')
+
+    def __init__(self, p_pathCsv, p_csvDialect=None):
+        """
+        :param p_pathCsv: Path of the local Browscap CSV file (downloaded if absent or out of date)
+        :param p_csvDialect: :any:`csv.Dialect` of the file, if not the standard one (:any:`cm_csvDialect`)
+        """
         # logger
         self.m_logger = logging.getLogger('BrowscapCache')
 
+        # CSV format of the file
+        self.m_csvDialect = BrowscapCache.cm_csvDialect if p_csvDialect is None else p_csvDialect
+
         self.m_logger.info('Loading Browscap local source file:' + p_pathCsv)
 
         # 0. if no local csv file --> download from BCP server
+        l_upToDate = False
         if not os.path.isfile(p_pathCsv):
             self.m_logger.info('Local source file not found --> downloading')
             self.downloadCSVFile(BrowscapCache.cm_fileUrl, p_pathCsv)
+            l_upToDate = True
+        elif len(self.readDownloadMeta(p_pathCsv)) > 0:
+            # conditional download: the BCP server only sends the file if it has changed since the last download
+            # (in that case, no need for the version number round-trip of steps 2 & 3 below) Only possible when the
+            # validators come from an actual download (sidecar file written by downloadCSVFile())
+            self.m_logger.info('Checking for a newer browscap file')
+            self.downloadCSVFile(BrowscapCache.cm_fileUrl, p_pathCsv, p_conditional=True)
+            l_upToDate = True
+
+        # the version number request of step 2 (if needed) runs in the background while the local file is read
+        l_versionProbe = None
+        if not l_upToDate:
+            l_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            l_versionProbe = l_executor.submit(self.getLatestVersion, BrowscapCache.cm_versionUrl)
+            l_executor.shutdown(wait=False)
 
         # 1. Read the file header in order to determine the local version number ---------------------------------------
+        # (taken from the header sidecar file if it is up to date. Otherwise the CSV file is opened and kept open so
+        # that the rows can be loaded from it in step 4 without re-reading the header)
         l_localVersion = 0
+        l_csvFile = None
+        l_line = self.readHeaderCache(p_pathCsv)
         try:
-            with open(p_pathCsv, 'r') as l_csvFile:
-                # figures out the CSV parameters (field sep, string delimiter, ...) hopefully
-                l_csvDialect = csv.Sniffer().sniff(l_csvFile.read(4096))
-
-                # Goes back to begining of file
-                l_csvFile.seek(0)
-                self.m_logger.info('Getting file version and release date')
-
-                # skip top line with "GJK_Browscap_Version","GJK_Browscap_Version"
-                l_csvFile.readline()
-
-                l_line = next(csv.reader(StringIO(l_csvFile.readline()), dialect=l_csvDialect))
-                # this gets the SECOND line of the file (the first was skipped)
-                try:
-                    l_localVersion = int(l_line[0])
-                except ValueError:
-                    self.m_logger.warning('ValueError while converting browscap file version:' + l_line[0])
-                    raise
-                except Exception as e:
-                    self.m_logger.warning('Error while retrieving browscap file version: {0}-{1}'.format(
-                        type(e).__name__, repr(e)
-                    ))
-
-                self.m_logger.info('Local browcap file version: {0}'.format(l_localVersion))
+            if l_line is None:
+                l_csvFile, l_line = self.openCSVFile(p_pathCsv)
+                self.saveHeaderCache(p_pathCsv, l_line)
+            try:
+                l_localVersion = int(l_line[0])
+            except ValueError:
+                self.m_logger.warning('ValueError while converting browscap file version:' + l_line[0])
+                raise
+            except Exception as e:
+                self.m_logger.warning('Error while retrieving browscap file version: {0}-{1}'.format(
+                    type(e).__name__, repr(e)
+                ))
+
+            self.m_logger.info('Local browcap file version: {0}'.format(l_localVersion))
         except Exception as e:
             self.m_logger.warning('Local browscap file [{0}] exists but cannot be read {1}-{2}'.format(
                 p_pathCsv, type(e).__name__, repr(e)
             ))
 
-        # 2. Download latest version number from BCP server ------------------------------------------------------------
-        l_latestVersion = self.getLatestVersion(BrowscapCache.cm_versionUrl)
+        # 2. Download latest version number from BCP server (unless the file is known to be up to date) ----------------
+        # (a network error is re-raised, once the CSV file possibly opened in step 1 has been closed)
+        try:
+            if l_versionProbe is not None:
+                l_latestVersion = l_versionProbe.result()
+            elif l_line is not None:
+                l_latestVersion = l_localVersion
+            else:
+                l_latestVersion = self.getLatestVersion(BrowscapCache.cm_versionUrl)
+        except BaseException:
+            if l_csvFile is not None:
+                l_csvFile.close()
+            raise
 
-        # 3. if versions differ --> download csv file from BCP server
+        # 3. if versions differ --> download csv file from BCP server and re-open it
         if l_latestVersion != l_localVersion:
             self.m_logger.info('Different versions: {0}/{1} --> Downloading [{2}]'.format(
                 l_localVersion, l_latestVersion, BrowscapCache.cm_fileUrl))
+            if l_csvFile is not None:
+                l_csvFile.close()
             self.downloadCSVFile(BrowscapCache.cm_fileUrl, p_pathCsv)
+            l_csvFile, l_line = self.openCSVFile(p_pathCsv)
+            self.saveHeaderCache(p_pathCsv, l_line)
 
         # 4. load csv file in memory
-        l_cacheRows = []
-        with open(p_pathCsv, 'r') as l_csvFile:
-            # figures out the CSV parameters (field sep, string delimiter, ...) hopefully
-            l_csvDialect = csv.Sniffer().sniff(l_csvFile.read(4096))
-
-            # Goes back to begining of file
-            l_csvFile.seek(0)
-
-            # skip top line with "GJK_Browscap_Version","GJK_Browscap_Version"
-            l_csvFile.readline()
-
-            l_line = next(csv.reader(StringIO(l_csvFile.readline()), dialect=l_csvDialect))
-            # this gets the SECOND line of the file (the first was skipped)
-
+        try:
             # Determines Browscap file release date --------------------------------------------------------------------
-            old_locale = locale.getlocale()
+            # (RFC 2822 date, e.g. `Mon, 12 Dec 2016 09:52:36 +0000` --> parsed by the e-mail date parser, which does
+            # not depend on the process-wide locale, unlike strptime() month names)
             l_releaseDate = None
             try:
-                locale.setlocale(locale.LC_TIME, locale.normalize('en_US.utf8'))
-                l_releaseDate = datetime.datetime.strptime(l_line[1][:-6], '%a, %d %b %Y %H:%M:%S')
-            except (ValueError, locale.Error):
+                l_releaseDate = email.utils.parsedate_to_datetime(l_line[1]).replace(tzinfo=None)
+            except (TypeError, ValueError):
                 self.m_logger.exception(
                     'Error while converting browscap file release date into a datetime:' + l_line[1])
             except Exception as e:
                 self.m_logger.warning('Error while retrieving browscap file release date: {0}-{1}'.format(
                     type(e).__name__, repr(e)
                 ))
-            finally:
-                locale.setlocale(locale.LC_TIME, old_locale)
 
             self.m_logger.info('Local browscap file release date: {0}'.format(l_releaseDate))
 
-            # Start reading data rows ----------------------------------------------------------------------------------
-            # the csv lib starts at the THRID line of the file, reads the column headers and then the rows one by one
-            self.m_logger.info('Reading browscap user-agent data')
-            l_reader = csv.DictReader(l_csvFile, dialect=l_csvDialect)
-            l_defaults = {}
-            for l_line in l_reader:
-                l_line = BrowscapCache.pythonize(l_line)
-                if l_line['parent'] == '':
-                    # This is the "Default of the Defaults" top line of the file -- Not used
-                    continue
-                if l_line['parent'] == 'DefaultProperties':
-                    # This is the default line for each group of UserAgents --> Stored in defaults
-                    l_defaults = l_line
-                    continue
-
-                l_cacheRows.append(BrowscapCache.replace_defaults(l_line, l_defaults))
-
-        self.m_logger.info('Space taken by l_cacheRows: {0:,} bytes'.format(sys.getsizeof(l_cacheRows)))
-        self.m_cacheRows = l_cacheRows
-
-        self.initCacheMedium()
-        self.initCacheFast()
-        self.initCacheHeavy()
+            # Load the data rows, from the pickled image of a previous load if it matches the file version -------------
+            l_pathPickle = p_pathCsv + '.pkl'
+            # (file version, release date, dialect the file was read with, pickle format)
+            l_pickleKey = (l_line[0], l_line[1], self.dialectKey(), BrowscapCache.cm_pickleFormat)
+            l_fields, l_cacheRows = self.loadPickle(l_pathPickle, l_pickleKey) or (None, None)
+            if l_cacheRows is None:
+                if l_csvFile is None:
+                    l_csvFile, l_line = self.openCSVFile(p_pathCsv)
+                l_fields, l_cacheRows = self.readCSVRows(l_csvFile)
+                self.savePickle(l_pathPickle, l_pickleKey, (l_fields, l_cacheRows))
+        finally:
+            if l_csvFile is not None:
+                l_csvFile.close()
+
+        # rows are turned into named tuples (same footprint as plain tuples, plus access by column name), with the
+        # Browscap behaviour for missing columns. They are pickled as plain tuples since the named tuple class only
+        # exists at run time
+        self.m_rowType = type('BrowscapRow', (Browscap, collections.namedtuple('BrowscapRow', l_fields, rename=True)),
+                              {'__slots__': ()})
+        self.m_cacheRows = list(map(self.m_rowType._make, l_cacheRows))
+        self.m_logger.info('Space taken by l_cacheRows: {0:,} bytes'.format(sys.getsizeof(self.m_cacheRows)))
+
+        # column name --> position within the rows of m_cacheRows
+        self.m_fieldIndex = {l_field: l_idx for l_idx, l_field in enumerate(l_fields)}
+        self.m_idxPropertyName = self.m_fieldIndex['propertyname']
+        self.m_idxBrowser = self.m_fieldIndex['browser']
+        self.m_idxMajorVer = self.m_fieldIndex['majorver']
+
+        # user agent pattern --> compiled regex (see compiledUaPattern())
+        self.m_reCompiledCache = dict()
+
+        # location and key of the pickled lookup cache indexes (see cachedIndex())
+        self.m_pathCsv = p_pathCsv
+        self.m_pickleKey = l_pickleKey
+
+        # the lookup caches are only built when the corresponding idBrowser* method is first called (see
+        # initCacheOnce()), one lock per cache
+        self.m_cacheLocks = {l_cache: threading.Lock() for l_cache in ('fast', 'medium', 'heavy')}
+
+        # per-instance result caches, keyed on the user agent string (bound methods wrapped as instance
+        # attributes, so that the caches do not hold the instance as part of their keys)
+        for l_method in ('idBrowserAnalytic', 'idBrowserFastAndDirty', 'idBrowserMedium', 'idBrowserHeavy'):
+            setattr(self, l_method, functools.lru_cache(maxsize=BrowscapCache.cm_uaCacheSize)(getattr(self, l_method)))
+
+    def openCSVFile(self, p_pathCsv):
+        """
+        Opens the local Browscap CSV file and reads its two header lines. The file is left positioned on the
+        column headers line so that it can be passed directly to :any:`csv.reader`.
+
+        :param p_pathCsv: Path of the local CSV file
+        :return: A tuple (open file object, parsed second line of the file: [version, release date])
+        """
+        # the file is read as a text stream through a 1 Mb buffer: decoding is done by the io module in large C-level
+        # chunks (an mmap-based byte splitter was tried and was slower, since csv.reader needs str lines anyway).
+        # The encoding is fixed so that it does not depend on the locale of the host
+        l_csvFile = open(p_pathCsv, 'r', newline='', buffering=1 << 20, encoding='utf-8')
+        self.m_logger.info('Getting file version and release date')
+
+        # skip top line with "GJK_Browscap_Version","GJK_Browscap_Version"
+        l_csvFile.readline()
+
+        # this gets the SECOND line of the file (the first was skipped). It normally is `"<version>","<date>"`
+        # --> split directly. Anything else goes through csv.reader (which accepts any iterable of lines --> no need
+        # to wrap the line in a StringIO)
+        l_raw = l_csvFile.readline()
+        l_rawStripped = l_raw.rstrip('\r\n')
+        if l_rawStripped.count('"') == 4 and l_rawStripped.startswith('"') and l_rawStripped.endswith('"') and \
+                l_rawStripped.count('","') == 1:
+            l_line = l_rawStripped[1:-1].split('","')
+        else:
+            l_line = next(csv.reader([l_raw], dialect=self.m_csvDialect))
+
+        return l_csvFile, l_line
+
+    def readHeaderCache(self, p_pathCsv):
+        """
+        Reads the header line saved by :any:`BrowscapCache.saveHeaderCache`, provided the CSV file is still the one
+        it was saved from (exact same size and modification time). Otherwise the header cache file is removed.
+
+        The modification time alone is not enough: a CSV file replaced by a copy keeping its original (older)
+        modification time (`cp -p`, `rsync -a`, restore from a backup) would otherwise keep the previous header.
+
+        :param p_pathCsv: Path of the local CSV file
+        :return: The second line of the CSV file ([version, release date]) or `None` if the header must be read
+            from the CSV file itself.
+        """
+        l_pathHeader = p_pathCsv + '.header.json'
+        try:
+            with open(l_pathHeader, 'r') as l_file:
+                l_cache = json.load(l_file)
+            l_stat = os.stat(p_pathCsv)
+            if l_cache['size'] == l_stat.st_size and l_cache['mtime_ns'] == l_stat.st_mtime_ns:
+                return l_cache['line']
+        except Exception as e:
+            self.m_logger.info('No usable browscap header cache -- {0}-{1}'.format(type(e).__name__, repr(e)))
+
+        # stale or unreadable --> dropped (re-created by saveHeaderCache() once the header has been read)
+        try:
+            os.remove(l_pathHeader)
+        except OSError:
+            pass
+        return None
+
+    def saveHeaderCache(self, p_pathCsv, p_line):
+        """
+        Saves the second line of the CSV file ([version, release date]) next to it, together with the size and
+        modification time (ns) of the CSV file, so that the next start-up does not need to open the CSV file if the
+        rows can be loaded from the pickle file. Failure is not fatal (only logged).
+
+        :param p_pathCsv: Path of the local CSV file
+        :param p_line: parsed second line of the file (see :any:`BrowscapCache.openCSVFile`)
+        """
+        try:
+            l_stat = os.stat(p_pathCsv)
+            with open(p_pathCsv + '.header.json', 'w') as l_file:
+                json.dump({'size': l_stat.st_size, 'mtime_ns': l_stat.st_mtime_ns, 'line': p_line}, l_file)
+        except Exception as e:
+            self.m_logger.warning('Error while saving browscap header cache -- {0}-{1}'.format(
+                type(e).__name__, repr(e)))
+
+    def readCSVRows(self, p_csvFile):
+        """
+        Reads the Browscap user-agent data rows, pythonizes them and replaces the default values.
+
+        :param p_csvFile: The CSV file, positioned on the column headers line (see :any:`BrowscapCache.openCSVFile`)
+        :return: A tuple (list of lowercased column names, list of row tuples)
+        """
+        # the csv lib starts at the THRID line of the file, reads the column headers and then the rows one by one
+        self.m_logger.info('Reading browscap user-agent data')
+        l_reader = csv.reader(p_csvFile, dialect=self.m_csvDialect)
+        # column names are lowercased once here, for the whole file, rather than for each cell
+        l_fields = [l_field.lower() for l_field in next(l_reader)]
+        l_parentIdx = l_fields.index('parent')
+        l_defaults = []
+        l_cacheRows = []
+        l_pythonize = BrowscapCache.rowConverter(l_fields)
+        l_zeroDefaultIdx = BrowscapCache.zeroDefaultPositions(l_fields)
+        # the loop runs once per row of a large file --> functions bound to locals once (no attribute lookups)
+        l_replaceDefaults = BrowscapCache.replace_defaults
+        l_append = l_cacheRows.append
+        for l_row in l_reader:
+            l_row = l_pythonize(l_row)
+            l_parent = l_row[l_parentIdx]
+            if l_parent == '':
+                # This is the "Default of the Defaults" top line of the file -- Not used
+                continue
+            if l_parent == 'DefaultProperties':
+                # This is the default line for each group of UserAgents --> Stored in defaults
+                l_defaults = l_row
+                continue
+
+            # rows are stored as tuples (one slot per column) rather than dicts repeating all the column names
+            l_append(tuple(l_replaceDefaults(l_row, l_defaults, l_zeroDefaultIdx)))
+
+        return l_fields, l_cacheRows
+
+    def dialectKey(self):
+        """
+        :return: The parameters of :any:`m_csvDialect`, as a tuple (part of the pickled data key, see
+            :any:`BrowscapCache.loadPickle`)
+        """
+        return tuple(getattr(self.m_csvDialect, l_attr, None) for l_attr in (
+            'delimiter', 'quotechar', 'escapechar', 'doublequote', 'skipinitialspace', 'quoting', 'strict'))
+
+    def loadPickle(self, p_pathPickle, p_key):
+        """
+        Loads data saved by :any:`BrowscapCache.savePickle` during a previous start-up, provided it was obtained
+        from the same version of the Browscap file (loaded rows, lookup cache indexes).
+
+        :param p_pathPickle: Path of the pickle file
+        :param p_key: key of the data: (version, release date) strings read from the CSV file header, CSV dialect
+            (see :any:`BrowscapCache.dialectKey`) and :any:`cm_pickleFormat`, possibly followed by anything else the
+            data depends on
+        :return: The saved data or `None` if the pickle file does not exist, cannot be read, or was produced from
+            another version of the CSV file.
+        """
+        if not os.path.isfile(p_pathPickle):
+            return None
+
+        try:
+            with open(p_pathPickle, 'rb') as l_file:
+                l_key, l_payload = pickle.load(l_file)
+        except Exception as e:
+            self.m_logger.warning('Browscap pickle file [{0}] exists but cannot be read {1}-{2}'.format(
+                p_pathPickle, type(e).__name__, repr(e)
+            ))
+            return None
+
+        if l_key != p_key:
+            self.m_logger.info('Browscap pickle file [{0}] is outdated: {1}/{2}'.format(p_pathPickle, l_key, p_key))
+            return None
+
+        self.m_logger.info('Browscap data loaded from:' + p_pathPickle)
+        return l_payload
+
+    def savePickle(self, p_pathPickle, p_key, p_payload):
+        """
+        Saves data to a pickle file next to the CSV file, so that the next start-up can skip computing it (see
+        :any:`BrowscapCache.loadPickle`). Failure is not fatal (only logged).
+
+        :param p_pathPickle: Path of the pickle file
+        :param p_key: key of the data (see :any:`BrowscapCache.loadPickle`)
+        :param p_payload: the data (any picklable object)
+        """
+        l_pathPart = p_pathPickle + '.part'
+        try:
+            with open(l_pathPart, 'wb') as l_file:
+                pickle.dump((p_key, p_payload), l_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(l_pathPart, p_pathPickle)
+        except Exception as e:
+            self.m_logger.warning('Error while saving browscap pickle file [{0}] -- {1}-{2}'.format(
+                p_pathPickle, type(e).__name__, repr(e)
+            ))
+
+    def cachedIndex(self, p_name, p_entries):
+        """
+        Inverted index of a lookup cache (see :any:`BrowscapCache.indexUaPatterns`), loaded from the
+        `<csv>.<p_name>.pkl` file saved by a previous start-up if it was built from the same patterns (same file
+        version, same :any:`cm_pickleFormat` and same digest of the patterns, in order). Otherwise it is built and
+        saved.
+
+        :param p_name: name of the lookup cache (`heavy`, `medium`)
+        :param p_entries: list of (head, literal, pattern, row) tuples
+        :return: (token index, unindexed positions) tuple
+        """
+        l_digest = hashlib.blake2b('\n'.join(l_pattern for _, _, l_pattern, _ in p_entries).encode(),
+                                   digest_size=16).hexdigest()
+        l_pathPickle = '{0}.{1}.pkl'.format(self.m_pathCsv, p_name)
+        l_key = self.m_pickleKey + (l_digest,)
+
+        l_index = self.loadPickle(l_pathPickle, l_key)
+        if l_index is None:
+            l_index = BrowscapCache.indexUaPatterns(p_entries)
+            self.savePickle(l_pathPickle, l_key, l_index)
+
+        return l_index
 
     @staticmethod
     def uaPattern2re(p_uaPattern):
-        l_re = '^{0}$'.format(re.escape(p_uaPattern))
-        l_re = l_re.replace('\\?', '.').replace('\\*', '.*?')
+        """
+        :param p_uaPattern: A Browscap user agent pattern (`*` and `?` wildcards)
+        :return: The equivalent regex, without anchors: it is meant to be applied with `fullmatch()`. `*` becomes
+            a greedy `.*`: only the match/no match outcome is used (no groups), which is the same for lazy and greedy
+            repeats under a full-string match, and greedy repeats backtrack less (a trailing `*` consumes the rest of
+            the string at once, instead of one character per retry)
+        """
+        l_re = re.escape(p_uaPattern)
+        l_re = l_re.replace('\\?', '.').replace('\\*', '.*')
 
         return l_re
 
+    @staticmethod
+    def uaPatternLiteral(p_uaPattern):
+        """
+        :param p_uaPattern: A Browscap user agent pattern (`*` and `?` wildcards)
+        :return: The longest wildcard-free fragment of the pattern. Any user agent string matching the pattern
+            contains it --> a cheap (C-level) `in` test rules out most patterns before their regex is run. The
+            string is interned: many patterns share the same literal, and the medium and heavy caches hold the
+            literals of the same rows.
+        """
+        return sys.intern(max(BrowscapCache.cm_reWildcards.split(p_uaPattern), key=len))
+
+    @staticmethod
+    def uaPatternEntry(p_uaPattern, p_row):
+        """
+        :param p_uaPattern: A Browscap user agent pattern (`*` and `?` wildcards)
+        :param p_row: The row the pattern belongs to
+        :return: Lookup cache entry (head, literal, pattern, row). The head is the fragment of the pattern before its
+            first wildcard: patterns are anchored --> a matching user agent string starts with it (`startswith()`
+            test, cheaper still than the `in` test of the literal, see :any:`BrowscapCache.uaPatternLiteral`).
+        """
+        l_head = sys.intern(BrowscapCache.cm_reWildcards.split(p_uaPattern, 1)[0])
+        return l_head, BrowscapCache.uaPatternLiteral(p_uaPattern), p_uaPattern, p_row
+
+    @staticmethod
+    def uaPatternTokens(p_uaPattern):
+        """
+        Word tokens (`\\w+` runs) of a pattern which are guaranteed to be complete tokens of any matching user
+        agent string, i.e. not touching a wildcard (a token next to a wildcard may be part of a longer one in the
+        user agent string). Tokens at the very beginning or end of the pattern qualify since patterns are anchored.
+
+        :param p_uaPattern: A Browscap user agent pattern (`*` and `?` wildcards)
+        :return: set of tokens (possibly empty)
+        """
+        l_fragments = BrowscapCache.cm_reWildcards.split(p_uaPattern)
+        l_last = len(l_fragments) - 1
+        l_tokens = set()
+        for i, l_fragment in enumerate(l_fragments):
+            for l_match in BrowscapCache.cm_reToken.finditer(l_fragment):
+                if (l_match.start() > 0 or i == 0) and (l_match.end() < len(l_fragment) or i == l_last):
+                    l_tokens.add(l_match.group())
+
+        return l_tokens
+
+    @staticmethod
+    def indexUaPatterns(p_entries):
+        """
+        Inverted index of a list of (head, literal, pattern, row) entries (see :any:`BrowscapCache.uaPatternEntry`):
+        each entry is filed under the rarest of its guaranteed tokens (see :any:`BrowscapCache.uaPatternTokens`),
+        so that a user agent string only needs to be checked against the entries filed under one of its own
+        tokens (plus the few entries without any guaranteed token).
+
+        :param p_entries: list of (head, literal, pattern, row) tuples
+        :return: (token --> ascending list of entry positions, ascending list of unindexed entry positions)
+        """
+        l_entryTokens = [BrowscapCache.uaPatternTokens(l_pattern) for _, _, l_pattern, _ in p_entries]
+        l_frequency = collections.Counter(itertools.chain.from_iterable(l_entryTokens))
+
+        l_index = dict()
+        l_unindexed = []
+        for i, l_tokens in enumerate(l_entryTokens):
+            if l_tokens:
+                # rarest token first, then the longest one, then alphabetical (deterministic)
+                l_token = min(l_tokens, key=lambda t: (l_frequency[t], -len(t), t))
+                l_index.setdefault(l_token, []).append(i)
+            else:
+                l_unindexed.append(i)
+
+        return l_index, l_unindexed
+
+    def matchIndexed(self, p_entries, p_index, p_ua):
+        """
+        First entry (in list order, as for a linear scan) whose pattern matches the user agent string, only
+        looking at the candidates given by the inverted index (see :any:`BrowscapCache.indexUaPatterns`).
+
+        :param p_entries: list of (head, literal, pattern, row) tuples
+        :param p_index: (token index, unindexed positions) tuple built from `p_entries`
+        :param p_ua: user agent string
+        :return: The matching row or `None`
+        """
+        l_tokenIndex, l_unindexed = p_index
+        l_postings = [l_tokenIndex[t] for t in set(BrowscapCache.cm_reToken.findall(p_ua)) if t in l_tokenIndex]
+        l_postings.append(l_unindexed)
+
+        # posting lists are disjoint and sorted --> lazy merge, stopping at the first match
+        for i in heapq.merge(*l_postings):
+            l_head, l_literal, l_pattern, l_row = p_entries[i]
+            if p_ua.startswith(l_head) and l_literal in p_ua and self.compiledUaPattern(l_pattern).fullmatch(p_ua):
+                return l_row
+
+        return None
+
     def idBrowserAnalytic(self, p_ua):
         l_browser = 'Unknown'
         l_platform = 'Unknown'
 
-        l_match  = re.search('((Mozilla|Opera|UCWEB)/\d+\.\d+)(\s|)\(([^\)]*)\)(.*)', p_ua)
+        l_match = BrowscapCache.cm_reAnalyticSplit.search(p_ua)
         if l_match:
             l_head = l_match.group(1)
             l_body = l_match.group(4)
@@ -164,303 +638,223 @@ class BrowscapCache:
             l_tailL = l_tail.lower()
             l_bodL = l_body.lower()
 
-            if re.search('opera|opr', l_tailL) or re.search('opera', l_head.lower()):
+            # highest priority browser keyword found in the tail, then the tests on the head and the body, which can
+            # only win over a lower priority one
+            l_rank, l_browser = min(
+                (BrowscapCache.cm_analyticBrowsers[l_kw.lastindex]
+                 for l_kw in BrowscapCache.cm_reAnalyticBrowser.finditer(l_tailL)),
+                default=(11, l_browser))
+            if l_rank > 0 and 'opera' in l_head.lower():
                 l_browser = 'Opera'
-            elif re.search('edge', l_tailL):
-                l_browser = 'Edge'
-            elif re.search('fxios', l_tailL):
-                l_browser = 'Firefox'
-            elif re.search('ucbrowser', l_tailL):
-                l_browser = 'UC Browser'
-            elif re.search('msie', l_bodL):
+            elif l_rank > 4 and 'msie' in l_bodL:
                 l_browser = 'IE'
-            elif re.search('chromium', l_tailL):
-                l_browser = 'Chromium'
-            elif re.search('chrome|crios|crmo', l_tailL):
-                l_browser = 'Chrome'
-            elif re.search('safari', l_tailL):
-                l_browser = 'Safari'
-            elif re.search('windows.*trident', l_bodL):
+            elif l_rank > 8 and BrowscapCache.cm_reAnalyticTrident.search(l_bodL):
                 l_browser = 'IE'
-            elif re.search('firefox', l_tailL):
-                l_browser = 'Firefox'
-            elif re.search('gecko', l_tailL):
-                l_browser = 'Firefox'
-
-            if re.search('android', l_bodL):
-                l_platform = 'Android'
-                if l_browser == 'Safari':
+
+            l_platformIdx = min(
+                (l_kw.lastindex for l_kw in BrowscapCache.cm_reAnalyticPlatform.finditer(l_bodL)), default=None)
+            if l_platformIdx is not None:
+                l_platform = BrowscapCache.cm_analyticPlatforms[l_platformIdx]
+                if l_platform == 'Android' and l_browser == 'Safari':
                     l_browser = 'Android'
-            elif re.search('iphone\sos', l_bodL):
-                l_platform = 'iOS'
-            elif re.search('ipad', l_bodL):
-                l_platform = 'iOS'
-            elif re.search('cros', l_bodL):
-                l_platform = 'ChromeOS'
-            elif re.search('windows\snt\s5', l_bodL):
-                l_platform = 'WinXP'
-            elif re.search('windows\snt\s6\.0', l_bodL):
-                l_platform = 'WinVista'
-            elif re.search('windows\snt\s6\.1', l_bodL):
-                l_platform = 'Win7'
-            elif re.search('windows\snt\s6\.2', l_bodL):
-                l_platform = 'Win8'
-            elif re.search('windows\snt\s6\.3', l_bodL):
-                l_platform = 'Win8.1'
-            elif re.search('windows\snt\s10', l_bodL):
-                l_platform = 'Win10'
-            elif re.search('windows', l_bodL):
-                l_platform = 'Windows'
-            elif re.search('mac\sos\sx', l_bodL):
-                l_platform = 'MacOSX'
-            elif re.search('ubuntu', l_bodL):
-                l_platform = 'Ubuntu'
-            elif re.search('linux', l_bodL):
-                l_platform = 'Linux'
-
-
-        if re.search('safari.*darwin', p_ua.lower()):
+
+        l_uaL = p_ua.lower()
+        if BrowscapCache.cm_reAnalyticDarwin.search(l_uaL):
             l_browser = 'Safari'
             l_platform = 'iOS'
 
-        if re.search('facebookexternalhit|FBAN|FBAV|FBBV|FBRV|FBDV|FBSN|FBSV|FBSS|FBCR|FBIOS', p_ua):
+        if BrowscapCache.cm_reAnalyticFacebook.search(p_ua):
             l_browser = 'Facebook'
 
-        if re.search('bot|spider|crawl|curl|wget|python|phantomjs', p_ua.lower()):
+        if BrowscapCache.cm_reAnalyticBot.search(l_uaL):
             l_browser = 'Bot'
             l_platform = ''
 
         return l_browser, l_platform
 
+    def compiledUaPattern(self, p_uaPattern):
+        """
+        Compiled regex of a Browscap user agent pattern. Compilation takes place the first time the pattern is
+        needed, i.e. only for the (few) patterns whose literal (see :any:`BrowscapCache.uaPatternLiteral`) was
+        found in a user agent string, instead of for every row at start-up.
+
+        :param p_uaPattern: A Browscap user agent pattern (`*` and `?` wildcards)
+        :return: The compiled regex (see :any:`BrowscapCache.uaPattern2re`)
+        """
+        try:
+            return self.m_reCompiledCache[p_uaPattern]
+        except KeyError:
+            l_reCompiled = re.compile(BrowscapCache.uaPattern2re(p_uaPattern))
+            self.m_reCompiledCache[p_uaPattern] = l_reCompiled
+            return l_reCompiled
+
+    def initCacheOnce(self, p_cache, p_attribute, p_init):
+        """
+        Builds a lookup cache unless another thread has done it in the meantime.
+
+        :param p_cache: name of the cache (key of `m_cacheLocks`)
+        :param p_attribute: the attribute the init method sets last --> its presence means the cache is complete
+        :param p_init: the init method (`initCacheFast`, `initCacheMedium` or `initCacheHeavy`)
+        """
+        with self.m_cacheLocks[p_cache]:
+            if p_attribute not in self.__dict__:
+                p_init()
+
     def initCacheHeavy(self):
+        # (head, literal, pattern, row) tuples. The regexes are compiled on demand (see compiledUaPattern())
         self.m_cachePrecompiledHeavy = []
 
         for l_row in self.m_cacheRows:
-            l_re = BrowscapCache.uaPattern2re(l_row['propertyname'])
-            self.m_cachePrecompiledHeavy.append((re.compile(l_re), l_row))
+            l_pattern = l_row[self.m_idxPropertyName]
+            self.m_cachePrecompiledHeavy.append(BrowscapCache.uaPatternEntry(l_pattern, l_row))
+
+        self.m_indexHeavy = self.cachedIndex('heavy', self.m_cachePrecompiledHeavy)
 
     def idBrowserHeavy(self, p_ua):
-        if 'm_cachePrecompiledHeavy' not in self.__dict__:
-            self.initCacheHeavy()
+        if 'm_indexHeavy' not in self.__dict__:
+            self.initCacheOnce('heavy', 'm_indexHeavy', self.initCacheHeavy)
 
-        for l_reCompiled, l_row in self.m_cachePrecompiledHeavy:
-            if l_reCompiled.search(p_ua):
-                return Browscap(l_row)
+        return self.matchIndexed(self.m_cachePrecompiledHeavy, self.m_indexHeavy, p_ua)
 
     def idBrowserSlow(self, p_ua):
+        # brute force (reference implementation): every pattern is compiled on the spot and thrown away, unless it is
+        # already in the compiled pattern cache of the heavy/medium lookups. Storing them there would pin a compiled
+        # regex for every row of the file after a single miss
+        l_reCompiledCache = self.m_reCompiledCache
         for l_row in self.m_cacheRows:
-            l_re = BrowscapCache.uaPattern2re(l_row['propertyname'])
-            #print(l_re)
-            if re.search(l_re, p_ua):
-                return Browscap(l_row)
+            l_pattern = l_row[self.m_idxPropertyName]
+            l_reCompiled = l_reCompiledCache.get(l_pattern)
+            if l_reCompiled is None:
+                l_reCompiled = re.compile(BrowscapCache.uaPattern2re(l_pattern))
+            if l_reCompiled.fullmatch(p_ua):
+                return l_row
 
         return None
 
     def initCacheMedium(self):
         l_deltaVer = 6
-        l_browserList = ['Chrome', 'Safari', 'IE', 'Opera', 'Firefox']
+        l_browserList = {'Chrome', 'Safari', 'IE', 'Opera', 'Firefox'}
         self.m_cachePrecompiled = []
+
+        # single pass over all the rows: the rows of the browsers of interest (candidates, in file order) and the
+        # latest version of each browser. The version filter is then applied to the candidates only
+        l_idxBrowser = self.m_idxBrowser
+        l_idxMajorVer = self.m_idxMajorVer
+        l_candidates = []
         l_maxVer = dict()
         for l_row in self.m_cacheRows:
-            l_browser = l_row['browser']
-            l_ver = l_row['majorver']
-
+            l_browser = l_row[l_idxBrowser]
             if l_browser not in l_browserList:
                 continue
 
-            try:
-                if l_maxVer[l_browser] < l_ver:
-                    l_maxVer[l_browser] = l_ver
-            except KeyError:
+            l_ver = l_row[l_idxMajorVer]
+            l_candidates.append((l_browser, l_ver, l_row))
+            if l_maxVer.get(l_browser, l_ver) <= l_ver:
                 l_maxVer[l_browser] = l_ver
 
         if EcAppParam.gcm_debugModeOn:
             for l_browser in l_maxVer.keys():
                 print('Max Ver {0:<20} --> {1}'.format(l_browser, l_maxVer[l_browser]))
 
-        l_countPattern = dict()
-        l_totalCount = 0
-        for l_row in self.m_cacheRows:
-            l_browser = l_row['browser']
-            l_ver = l_row['majorver']
-
-            if l_browser not in l_browserList:
-                continue
-
+        for l_browser, l_ver, l_row in l_candidates:
             if l_maxVer[l_browser] - l_ver < l_deltaVer:
-                l_re = BrowscapCache.uaPattern2re(l_row['propertyname'])
-                self.m_cachePrecompiled.append( (re.compile(l_re), l_row) )
-                l_totalCount += 1
-                try:
-                    l_countPattern[l_browser] += 1
-                except KeyError:
-                    l_countPattern[l_browser] = 1
+                self.m_cachePrecompiled.append(BrowscapCache.uaPatternEntry(l_row[self.m_idxPropertyName], l_row))
 
+        # diagnostic counts: only computed in debug mode (they are not needed to build the cache)
         if EcAppParam.gcm_debugModeOn:
+            l_countPattern = collections.Counter(l_row[self.m_idxBrowser] for *_, l_row in self.m_cachePrecompiled)
             for l_browser in l_countPattern.keys():
                 print('Count   {0:<20} --> {1:,}'.format(l_browser, l_countPattern[l_browser]))
 
-            print('Total : {0:,}'.format(l_totalCount))
+            print('Total : {0:,}'.format(len(self.m_cachePrecompiled)))
+
+        self.m_indexMedium = self.cachedIndex('medium', self.m_cachePrecompiled)
 
         self.m_logger.info('Space taken by m_cachePrecompiled: {0:,} bytes'.format(
             sys.getsizeof(self.m_cachePrecompiled)))
 
     def idBrowserMedium(self, p_ua):
-        if 'm_cachePrecompiled' not in self.__dict__:
-            self.initCacheMedium()
+        if 'm_indexMedium' not in self.__dict__:
+            self.initCacheOnce('medium', 'm_indexMedium', self.initCacheMedium)
 
-        for l_reCompiled, l_row in self.m_cachePrecompiled:
-            if l_reCompiled.search(p_ua):
-                return Browscap(l_row)
+        return self.matchIndexed(self.m_cachePrecompiled, self.m_indexMedium, p_ua)
 
     def initCacheFast(self):
-        self.m_rePrecompiled = []
-        l_reList = [
-            ('Chrome',
-             'Mozilla/5\.0(\s|)\(.*\).*AppleWebKit/.*\(KHTML.*like\sGecko.*\)(\s|)(Chrome|.*CriOS|.*CrMo)/(\d+\.|).*'),
-            ('UC Browser',
-             '.*(UCBrowser|UCWEB).*'),
-            ('Opera',
-             '.*Opera.*'),
-            ('IE',
-             'Mozilla/(\d\.0|\.*).*\(.*MSIE\s\d+\.(\d+|).*'),
-            ('Safari',
-             '.*Safari.*'),
-            ('Safari',
-             'Mozilla/5\.0(\s|)\(.*Mac\sOS\sX.*\).*AppleWebKit/.*'),
-            ('Firefox',
-             'Mozilla/\d\.0\s\(.*\).*Gecko.*(Firefox/\d+\.\d+.*|)'),
-        ]
-        for l_browser, l_re in l_reList:
-            self.m_rePrecompiled.append((l_browser, re.compile(l_re)))
+        self.m_rePrecompiled = [(l_browser, BrowscapCache.mainBrowserTest(l_literals, l_re))
+                                for l_browser, l_literals, l_re in BrowscapCache.cm_fastBrowsers]
 
     def idBrowserFastAndDirty(self, p_ua):
         if 'm_rePrecompiled' not in self.__dict__:
-            self.initCacheFast()
+            self.initCacheOnce('fast', 'm_rePrecompiled', self.initCacheFast)
 
-        for l_browser, l_reCompiled in self.m_rePrecompiled:
-            if l_reCompiled.search(p_ua):
+        for l_browser, l_test in self.m_rePrecompiled:
+            if l_test(p_ua):
                 return l_browser
 
         return 'Unknows'
 
-    def testMainBrowsers(self):
-        l_chromeStandard = 0
-        l_chromeElse = 0
-        l_firefoxStandard = 0
-        l_firefoxElse = 0
-        l_ieStandard = 0
-        l_ieElse = 0
-        l_operaStandard = 0
-        l_operaElse = 0
-        l_ucStandard = 0
-        l_ucElse = 0
-        l_safariStandard = 0
-        l_safariElse = 0
-        for l_row in self.m_cacheRows:
-            l_ua = l_row['propertyname']
-            l_browser = l_row['browser'].lower()
-            # Mozilla/5.0 (*Windows NT 6.3*Win64? x64**********************) AppleWebKit/* (KHTML* like Gecko) Chrome/50.*Safari/*
-            # Mozilla/5.0 (*Linux*Android?4.2*Nexus 5 Build/***************) AppleWebKit/* (KHTML* like Gecko*) Chrome/55.*Safari/*
-            # Mozilla/5.0 (*Linux*Android?4.1*Ergo Tab Crystal Lite Build/*) AppleWebKit/*(KHTML,*like Gecko) Chrome/55.*Safari/*
-            # Mozilla/5.0 (*Linux x86**************************************) AppleWebKit/* (KHTML,*like Gecko) Chrome/55.*
-            # Mozilla/5.0 (*Linux*Android?5.0******************************)*AppleWebKit/* (KHTML* like Gecko) Chrome/54.*Safari/*
-            # Mozilla/5.0(*Linux*Android?4.4*Fly IQ4409 Quad Build/*) AppleWebKit/*(KHTML* like Gecko) Chrome/54.*Safari/*
-            # Mozilla/5.0 (*Windows NT 10.0*WOW64*) AppleWebKit/* (KHTML* like Gecko) Chrome/*Anonymisiert durch*
-            # Mozilla/5.0 (iPad*CPU iPhone OS 3?0* like Mac OS X*) AppleWebKit/* (KHTML* like Gecko) *CriOS/55.*Safari/*
-            # Mozilla/5.0 (*Linux*Android?4.0*HTC_Sensation Build/*) AppleWebKit/* (KHTML* like Gecko)*CrMo/51.*Safari/*
-            if l_browser.lower() == 'chrome':
-                if re.search(
-                        'Mozilla/5\.0(\s|)\(.*\).*AppleWebKit/.*\(KHTML.*like\sGecko.*\)(\s|)(Chrome|.*CriOS|.*CrMo)/(\d+\.|).*', l_ua):
-                    #print('Match:' + l_ua)
-                    l_chromeStandard += 1
-                else:
-                    #print('Chrome No Match:' + l_ua)
-                    l_chromeElse += 1
-
-            # Mozilla/5.0 (*Windows NT 5.0; *WOW64*) Gecko* Firefox/46.0*
-            # Mozilla/4.0 (*Windows NT 10.0*WOW64*) Gecko* Firefox/50.0*
-            # Mozilla/5.0 (*Windows NT 6.4*rv:50.0*) Gecko*/
-            # Mozilla/5.0 (Tablet; rv:37.0*)*Gecko*Firefox/37.0*
-            if l_browser.lower() == 'firefox':
-                if re.search('Mozilla/\d\.0\s\(.*\).*Gecko.*(Firefox/\d+\.\d+.*|)', l_ua):
-                    # print('Match:' + l_ua)
-                    l_firefoxStandard += 1
-                else:
-                    # print('Firefox No Match:' + l_ua)
-                    l_firefoxElse += 1
-
-            # Mozilla/5.0 (compatible; MSIE 7.0; *Windows NT 6.1*Win64? x64*Trident/4.0*Mozilla/4.0 (compatible; MSIE 6.0*
-            # Mozilla/5.0 (compatible; MSIE 7.*Windows NT 6.0*Trident/6.0*)*
-            if l_browser.lower() == 'ie':
-                if re.search('Mozilla/(\d\.0|\.*).*\(.*MSIE\s\d+\.(\d+|).*', l_ua):
-                    # print('Match:' + l_ua)
-                    l_ieStandard += 1
-                else:
-                    # print('IE No Match:' + l_ua)
-                    l_ieElse += 1
-
-            # Mozilla/5.0 (*Windows NT 6.2*Win64? x64*) AppleWebKit/* (KHTML, like Gecko)*Chrome/*Safari/*OPR/35.0*
-            # Mozilla/5.0 (*Windows NT 6.2*Win64? x64*) AppleWebKit/* (KHTML, like Gecko)*Chrome/*Safari/*OPR/*
-            # Opera/9.80*(*Windows NT 5.2*)*Version/*
-            # Mozilla/?.*(*Mac OS X 10?10*)*Opera?3.00*
-            # Mozilla/5.0 (compatible; MSIE *Windows NT 6.2*Win64? x64*)*Opera*
-            if l_browser.lower() == 'opera':
-                if re.search('.*Opera.*', l_ua):
-                    # print('Match:' + l_ua)
-                    l_operaStandard += 1
-                else:
-                    # print('Opera No Match:' + l_ua)
-                    l_operaElse += 1
-
-            # Mozilla/5.0 (*Linux*Android?5.0* Build/*) AppleWebKit/* (KHTML, like Gecko) Version/* UCBrowser/10.7* U3/* Safari/*
-            # Mozilla/5.0 (*Linux*Android?2.3*) AppleWebKit/* (KHTML,*like Gecko*) UCBrowser/2.3*Safari/*
-            # Mozilla/5.0 (*CPU iPhone OS 9?0* like Mac OS X*)*AppleWebKit/*(*KHTML* like Gecko*)*UCBrowser/*
-            if l_browser.lower() == 'uc browser':
-                if re.search('.*(UCBrowser|UCWEB).*', l_ua):
-                    # print('Match:' + l_ua)
-                    l_ucStandard += 1
-                else:
-                    # print('UC No Match:' + l_ua)
-                    l_ucElse += 1
-
-            # Mozilla/5.0*(iPhone*CPU iPhone OS 5?1* like Mac OS X*)*AppleWebKit/*(*KHTML, like Gecko*)*Version/8.1*Safari/*
-            # Mozilla/5.0 (*Mac OS X 10?4*) AppleWebKit/* (KHTML* like Gecko) *Version/3.2* Safari/*
-            # Mozilla/5.0 (*Windows NT 6.2*) AppleWebKit/* (KHTML* like Gecko) *Version/5.0* Safari/*
-            # Mozilla/5.0 (*Linux*x86_64*) AppleWebKit/* (KHTML* like Gecko) *Version/7.1* Safari/*
-            if l_browser.lower() == 'safari':
-                if re.search('Mozilla/\d\.\d.*\(.*\).*AppleWebKit/.*\(.*KHTML.*like\sGecko.*\).*Version/\d+\.\d+.*Safari/.*', l_ua):
-                    # print('Match:' + l_ua)
-                    l_safariStandard += 1
-                else:
-                    print('Safari No Match:' + l_ua)
-                    l_safariElse += 1
-
-        print('l_chromeStandard  : {0}'.format(l_chromeStandard))
-        print('l_chromeElse      : {0}'.format(l_chromeElse))
+    @staticmethod
+    def mainBrowserTest(p_literals, p_re):
+        """
+        :param p_literals: substrings, one of which must be present (see :any:`cm_mainBrowsers`)
+        :param p_re: compiled regex the user agent string must also match, or `None`
+        :return: function telling whether a user agent string is "standard" (`True`/`False`)
+        """
+        def isStandard(p_ua):
+            for l_literal in p_literals:
+                if l_literal in p_ua:
+                    return p_re is None or p_re.search(p_ua) is not None
+            return False
 
-        print('l_firefoxStandard : {0}'.format(l_firefoxStandard))
-        print('l_firefoxElse     : {0}'.format(l_firefoxElse))
+        return isStandard
 
-        print('l_ieStandard      : {0}'.format(l_ieStandard))
-        print('l_ieElse          : {0}'.format(l_ieElse))
+    def testMainBrowsers(self):
+        """
+        Counts, for each of the main browsers, the rows whose user agent pattern matches the "standard" user
+        agent of this browser (see :any:`cm_mainBrowsers`) and those that do not.
+        """
+        # user agent patterns grouped by browser name, so that each group can be tested in a single C-level pass
+        l_uaByBrowser = collections.defaultdict(list)
+        for l_browser, l_ua in zip(map(operator.itemgetter(self.m_idxBrowser), self.m_cacheRows),
+                                   map(operator.itemgetter(self.m_idxPropertyName), self.m_cacheRows)):
+            l_uaByBrowser[l_browser].append(l_ua)
+
+        l_counters = collections.Counter()
+        for l_browser, l_uaList in l_uaByBrowser.items():
+            l_entry = BrowscapCache.cm_mainBrowsers.get(l_browser.lower())
+            if l_entry is None:
+                continue
 
-        print('l_operaStandard   : {0}'.format(l_operaStandard))
-        print('l_operaElse       : {0}'.format(l_operaElse))
+            l_literals, l_re, l_name = l_entry
+            # one test (dispatched by browser name above) per pattern, the outcomes serving both the counts and the
+            # Safari no-match listing
+            l_outcomes = list(map(BrowscapCache.mainBrowserTest(l_literals, l_re), l_uaList))
+            if l_name == 'safari':
+                for l_ua in itertools.compress(l_uaList, map(operator.not_, l_outcomes)):
+                    print('Safari No Match:' + l_ua)
 
-        print('l_ucStandard      : {0}'.format(l_ucStandard))
-        print('l_ucElse          : {0}'.format(l_ucElse))
+            l_standard = sum(l_outcomes)
+            l_counters[l_name + 'Standard'] += l_standard
+            l_counters[l_name + 'Else'] += len(l_uaList) - l_standard
 
-        print('l_safariStandard  : {0}'.format(l_safariStandard))
-        print('l_safariElse      : {0}'.format(l_safariElse))
+        for l_name in ['chrome', 'firefox', 'ie', 'opera', 'uc', 'safari']:
+            print('{0:<18}: {1}'.format('l_{0}Standard'.format(l_name), l_counters[l_name + 'Standard']))
+            print('{0:<18}: {1}'.format('l_{0}Else'.format(l_name), l_counters[l_name + 'Else']))
 
-    def downloadCSVFile(self, p_url_file, p_pathCsv, p_timeout=60, p_proxy=None, p_additional_handlers=None):
+    def downloadCSVFile(self, p_url_file, p_pathCsv, p_timeout=60, p_proxy=None, p_additional_handlers=None,
+                        p_conditional=False):
         """
+        The `ETag` and `Last-Modified` headers of the response are saved next to the CSV file (see
+        :any:`BrowscapCache.readDownloadMeta`) so that later downloads can be made conditional.
 
         :param p_url_file:
+        :param p_pathCsv:
         :param p_timeout:
         :param p_proxy:
         :param p_additional_handlers:
+        :param p_conditional: If `True`, the request carries `If-None-Match`/`If-Modified-Since` headers built
+            from the previous download, and nothing is downloaded if the server answers `304 Not Modified`.
+        :return: `True` if the file was downloaded, `False` if the local file is already up to date.
         """
 
         # Download csv file content
@@ -481,12 +875,26 @@ class BrowscapCache:
 
             urllib.request.install_opener(l_opener)
 
-            # download the file
-            l_responseFile = l_opener.open(p_url_file, timeout=p_timeout)
-            l_contents_file = l_responseFile.read()
-            l_responseFile.close()
+            # conditional request headers, from the previous download
+            # (the CSV text compresses about 10:1 --> compressed transfer if the server supports it)
+            l_request = urllib.request.Request(p_url_file, headers={'Accept-Encoding': 'gzip'})
+            if p_conditional:
+                l_meta = self.readDownloadMeta(p_pathCsv)
+                if 'etag' in l_meta:
+                    l_request.add_header('If-None-Match', l_meta['etag'])
+                if 'last_modified' in l_meta:
+                    l_request.add_header('If-Modified-Since', l_meta['last_modified'])
+
+            # open the download stream
+            l_responseFile = l_opener.open(l_request, timeout=p_timeout)
+        except urllib.error.HTTPError as e:
+            if p_conditional and e.code == 304:
+                self.m_logger.info('Browscap file from url [{0}] not modified'.format(p_url_file))
+                return False
 
-            self.m_logger.info('Download of browscap file from url [{0}] complete'.format(p_url_file))
+            self.m_logger.warning('Something went wrong while downloading browscap csv file ' +
+                                  'Url: {0} -- {1}-{2}'.format(p_url_file, type(e).__name__, repr(e)))
+            raise
         except urllib.error.URLError as e:
             self.m_logger.warning('Something went wrong while processing urllib handlers ' +
                                   'Url: {0} -- {1}-{2}'.format(p_url_file, type(e).__name__, repr(e)))
@@ -496,16 +904,63 @@ class BrowscapCache:
                                   'Url: {0} -- {1}-{2}'.format(p_url_file, type(e).__name__, repr(e)))
             raise
 
-        # save file content to local CSV file
+        # stream the file content to disk, 1 Mb at a time, instead of holding all of it in memory. It is written
+        # to a temporary file first, so that an interrupted download does not leave a truncated CSV file behind
+        l_pathPart = p_pathCsv + '.part'
         try:
             self.m_logger.info('Saving latest version of browscap file to:' + p_pathCsv)
-            with open(p_pathCsv, 'wb') as file:
-                file.write(l_contents_file)
+            with l_responseFile, open(l_pathPart, 'wb') as l_file:
+                if l_responseFile.headers.get('Content-Encoding', '').lower() == 'gzip':
+                    # decompressed on the fly, still 1 Mb at a time
+                    with gzip.GzipFile(fileobj=l_responseFile, mode='rb') as l_unzipped:
+                        shutil.copyfileobj(l_unzipped, l_file, 1 << 20)
+                else:
+                    shutil.copyfileobj(l_responseFile, l_file, 1 << 20)
+            os.replace(l_pathPart, p_pathCsv)
+
+            self.m_logger.info('Download of browscap file from url [{0}] complete'.format(p_url_file))
         except Exception as e:
-            self.m_logger.warning('Error while saving latest version of browscap csv file to [{0]]' +
-                                  ' -- {1}-{2}'.format(p_pathCsv, type(e).__name__, repr(e)))
+            self.m_logger.warning('Error while saving latest version of browscap csv file to ' +
+                                  '[{0}] -- {1}-{2}'.format(p_pathCsv, type(e).__name__, repr(e)))
+            # do not leave a partial download behind
+            if os.path.isfile(l_pathPart):
+                os.remove(l_pathPart)
             raise
 
+        # validators for the next (conditional) download
+        l_meta = dict()
+        if l_responseFile.headers.get('ETag') is not None:
+            l_meta['etag'] = l_responseFile.headers.get('ETag')
+        if l_responseFile.headers.get('Last-Modified') is not None:
+            l_meta['last_modified'] = l_responseFile.headers.get('Last-Modified')
+        try:
+            with open(p_pathCsv + '.meta.json', 'w') as l_file:
+                json.dump(l_meta, l_file)
+        except Exception as e:
+            self.m_logger.warning('Error while saving browscap download metadata -- {0}-{1}'.format(
+                type(e).__name__, repr(e)))
+
+        return True
+
+    def readDownloadMeta(self, p_pathCsv):
+        """
+        Reads the validators (`ETag`/`Last-Modified` headers) saved by :any:`BrowscapCache.downloadCSVFile`.
+
+        Nothing is returned if there is no sidecar file (CSV file not downloaded by :any:`downloadCSVFile`, e.g.
+        copied or restored from a backup: its modification time says nothing about its content) or if it is empty
+        (the server sent no validators), so that the version number check is used instead.
+
+        :param p_pathCsv: Path of the local CSV file
+        :return: A dict with `'etag'` and/or `'last_modified'` keys (empty if nothing usable was saved)
+        """
+        l_pathMeta = p_pathCsv + '.meta.json'
+        try:
+            with open(l_pathMeta, 'r') as l_file:
+                return json.load(l_file)
+        except Exception as e:
+            self.m_logger.info('No browscap download metadata -- {0}-{1}'.format(type(e).__name__, repr(e)))
+            return dict()
+
     def getLatestVersion(self, p_url_version, p_timeout=60, p_proxy=None, p_additional_handlers=None):
         """
 
@@ -534,9 +989,8 @@ class BrowscapCache:
             urllib.request.install_opener(l_opener)
 
             # download the version number from the version URL
-            l_responseVersion = l_opener.open(p_url_version, timeout=p_timeout)
-            l_version = bytes.decode(l_responseVersion.read())
-            l_responseVersion.close()
+            with l_opener.open(p_url_version, timeout=p_timeout) as l_responseVersion:
+                l_version = bytes.decode(l_responseVersion.read())
 
             self.m_logger.info('Latest version of browscap file from url [{0}] : {1}'.format(
                 p_url_version, l_version))
@@ -558,77 +1012,107 @@ class BrowscapCache:
         return l_version
 
     @staticmethod
-    def replace_defaults(p_line, p_defaults):
+    def replace_defaults(p_row, p_defaults, p_zeroDefaultIdx):
         """Replaces 'default' values for a line with parent line value and converting it into native python value.
 
-        :param line: original line from browscap file
-        :type line: dict
-        :param defaults: default values for current line
-        :type defaults: dict
-        :returns: dictionary with replaced default values
-        :rtype: dict
+        :param p_row: original line from browscap file (already pythonized)
+        :type p_row: list
+        :param p_defaults: default values for current line (same layout as `p_row`)
+        :type p_defaults: list
+        :param p_zeroDefaultIdx: positions of the columns for which 0 also means "default value" (see
+            :any:`BrowscapCache.zeroDefaultPositions`)
+        :type p_zeroDefaultIdx: frozenset
+        :returns: `p_row` itself, with default values replaced in place (the list built by
+            :any:`BrowscapCache.rowConverter` is not used elsewhere --> no need to copy it)
+        :rtype: list
         :raises: IOError
 
         """
-        l_newLine = {}
-        for l_feature, l_value in p_line.items():
-            if l_value == 'default' or l_value == '':
-                l_value = p_defaults[l_feature]
-            if (l_feature == 'Browser_Bits'.lower()
-                    or l_feature == 'Platform_Bits'.lower()
-                    or l_feature == 'MinorVer') and l_value == 0:
-                l_value = p_defaults[l_feature]
-            if (l_feature == 'CSSVersion'.lower()
-                    or l_feature == 'AolVersion'.lower()
-                    or l_feature == 'Version'.lower()
-                    or l_feature == 'RenderingEngine_Version'.lower()
-                    or l_feature == 'Platform_Version'.lower()) and l_value == 0:
-                l_value = p_defaults[l_feature]
-
-            l_newLine[l_feature] = l_value
-
-        return l_newLine
+        for l_idx, l_value in enumerate(p_row):
+            if l_value == 'default' or l_value == '' or (l_value == 0 and l_idx in p_zeroDefaultIdx):
+                p_row[l_idx] = p_defaults[l_idx]
+
+        return p_row
         # end of replace_defaults() ------------------------------------------------------------------------------------
 
     @staticmethod
-    def pythonize(p_line):
-        """
-        Turn all values in a browscap data row into Python datatypes (bool/int/float).
-
-        :param line: original line from browscap file
-        :type line: dict
-        :returns: dictionary with values turned into Python data types (bool, int, float)
-        :rtype: dict
-        """
-        l_newLine = {}
-        for l_feature, l_value in p_line.items():
-            l_featL = l_feature.lower()
-            l_valL = l_value.lower()
-            if l_valL == 'true':
-                l_value = True
-            elif l_valL == 'false':
-                l_value = False
-            elif l_featL == 'MajorVer'.lower() \
-                    or l_featL == 'Browser_Bits'.lower() \
-                    or l_featL == 'Platform_Bits'.lower() \
-                    or l_featL == 'MinorVer'.lower():
-                try:
-                    l_value = int(l_value)
-                except (ValueError, OverflowError):
-                    l_value = 0
-            elif l_featL == 'CSSVersion'.lower() \
-                    or l_featL == 'AolVersion'.lower() \
-                    or l_featL == 'Version'.lower() \
-                    or l_featL == 'RenderingEngine_Version'.lower() \
-                    or l_featL == 'Platform_Version'.lower():
-                try:
-                    l_value = float(l_value)
-                except (ValueError, OverflowError):
-                    l_value = float(0)
-
-            l_newLine[l_featL] = l_value
-        return l_newLine
-        # end of pythonize() ------------------------------------------------------------------------------------
+    def zeroDefaultPositions(p_fields):
+        """
+        :param p_fields: lowercased column names, in file order
+        :type p_fields: list
+        :returns: positions of the columns for which a 0 value is replaced by the default value (see
+            :any:`BrowscapCache.replace_defaults`)
+        :rtype: frozenset
+        """
+        return frozenset(l_idx for l_idx, l_feature in enumerate(p_fields)
+                         if l_feature in BrowscapCache.cm_intZeroDefaultFeatures or
+                         l_feature in BrowscapCache.cm_floatFeatures)
+
+    @staticmethod
+    def rowConverter(p_fields):
+        """
+        Builds the function turning all values of a browscap data row into Python datatypes (bool/int/float).
+
+        `'true'`/`'false'` (in any case) become booleans whatever the column. Otherwise, int/float columns are
+        converted (0 if the value cannot be converted) and the other values are left as strings.
+
+        Almost all cells are strings or booleans: they are all handled by a single C-level
+        `map(dict.setdefault, ...)` over the row. The dict maps every spelling of true/false to the corresponding
+        boolean and every other string to the first identical string seen (so that the many repeated values --
+        browser names, platforms, ... -- are stored only once). The few int/float columns are then converted
+        through a dict of already converted values, so that repeated numbers are shared too.
+
+        :param p_fields: lowercased column names, in file order
+        :type p_fields: list
+        :returns: a function taking the original line from browscap file (as returned by :any:`csv.reader`) and
+            returning the list of values turned into Python data types (bool, int, float)
+        :rtype: function
+        """
+        l_getBool = BrowscapCache.cm_boolValues.get
+
+        # int()/float() fail on 'true'/'false' anyway --> the boolean test is only made if the conversion fails
+        def toInt(p_value):
+            try:
+                return int(p_value)
+            except (ValueError, OverflowError):
+                l_bool = l_getBool(p_value.lower())
+                return 0 if l_bool is None else l_bool
+
+        def toFloat(p_value):
+            try:
+                return float(p_value)
+            except (ValueError, OverflowError):
+                l_bool = l_getBool(p_value.lower())
+                return float(0) if l_bool is None else l_bool
+
+        # all the upper/lower case spellings of true/false
+        l_pool = dict()
+        for l_word, l_bool in BrowscapCache.cm_boolValues.items():
+            for l_spelling in itertools.product(*zip(l_word, l_word.upper())):
+                l_pool[''.join(l_spelling)] = l_bool
+        l_pooled = l_pool.setdefault
+
+        # converted numbers, by original string, for int and float columns respectively: repeated values are
+        # converted only once and share the same int/float object (the two kinds are kept apart because
+        # 1 == 1.0 --> they would be mixed up in a single dict)
+        l_intPool = dict()
+        l_floatPool = dict()
+        l_numeric = [(l_idx, toInt, l_intPool) if l_feature in BrowscapCache.cm_intFeatures else
+                     (l_idx, toFloat, l_floatPool)
+                     for l_idx, l_feature in enumerate(p_fields)
+                     if l_feature in BrowscapCache.cm_intFeatures or l_feature in BrowscapCache.cm_floatFeatures]
+
+        def pythonize(p_row):
+            l_newRow = list(map(l_pooled, p_row, p_row))
+            for l_idx, l_convert, l_numPool in l_numeric:
+                l_value = p_row[l_idx]
+                l_number = l_numPool.get(l_value)
+                if l_number is None:
+                    l_number = l_numPool[l_value] = l_convert(l_value)
+                l_newRow[l_idx] = l_number
+            return l_newRow
+
+        return pythonize
 
 
 # ---------------------------------------------------- Test section ----------------------------------------------------
@@ -679,12 +1163,17 @@ if __name__ == "__main__":
     #   'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36',
     #   'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.8; rv:48.0) Gecko/20100101 Firefox/48.0']
 
-    l_misBrowser = dict()
-    l_misBot = dict()
-    l_misPlatform = dict()
+    # per UA display (-q on the command line to turn it off) The lines are written to stdout by blocks of
+    # 1000, not one by one
+    l_verbose = '-q' not in sys.argv[1:]
+    l_outLines = []
+
+    # (analytic browser, analytic platform, heavy browser, heavy platform) for each UA
+    l_results = []
     l_uaCounter = 0
     for l_ua in l_uaList:
-        print('[{0}] {1}'.format(l_uaCounter, l_ua))
+        if l_verbose:
+            l_outLines.append('[{0}] {1}'.format(l_uaCounter, l_ua))
         l_uaCounter += 1
 
         #t0 = time.perf_counter()
@@ -693,40 +1182,40 @@ if __name__ == "__main__":
         #l_totalTime = t1-t0
         #print('Fast  : {0:f} s. / {1}'.format(l_totalTime, l_bro))
 
-        t0 = time.perf_counter()
-        l_brA, l_ptfA = l_browscapCache.idBrowserAnalytic(l_ua)
-        t1 = time.perf_counter()
-        l_totalTime = t1-t0
-        print('Anal. : {0:f} s. --> {1}/{2}'.format(l_totalTime, l_brA, l_ptfA))
+        # timings only measured when displayed
+        if l_verbose:
+            t0 = time.monotonic_ns()
+            l_brA, l_ptfA = l_browscapCache.idBrowserAnalytic(l_ua)
+            t1 = time.monotonic_ns()
+            l_outLines.append('Anal. : {0:.3f} ms. --> {1}/{2}'.format((t1-t0)/1e6, l_brA, l_ptfA))
+
+            t0 = time.monotonic_ns()
+            l_br = l_browscapCache.idBrowserHeavy(l_ua)
+            t1 = time.monotonic_ns()
+        else:
+            l_brA, l_ptfA = l_browscapCache.idBrowserAnalytic(l_ua)
+            l_br = l_browscapCache.idBrowserHeavy(l_ua)
 
-        t0 = time.perf_counter()
-        l_br = l_browscapCache.idBrowserHeavy(l_ua)
         l_brB = l_br.browser if l_br is not None else 'Unknown'
         l_ptfB = l_br.platform if l_br is not None else 'Unknown'
-        t1 = time.perf_counter()
-        l_totalTime = t1-t0
-        print('Heavy : {0:f} s. --> {1}/{2}'.format(l_totalTime, l_brB, l_ptfB))
-
-        if l_brA != l_brB:
-            l_key = l_brA + '/' + l_brB
-
-            if l_brA == 'Bot':
-                try:
-                    l_misBot[l_key] += 1
-                except KeyError:
-                    l_misBot[l_key] = 1
-            else:
-                try:
-                    l_misBrowser[l_key] += 1
-                except KeyError:
-                    l_misBrowser[l_key] = 1
-
-        if l_ptfA != l_ptfB:
-            l_key = l_ptfA + '/' + l_ptfB
-            try:
-                l_misPlatform[l_key] += 1
-            except KeyError:
-                l_misPlatform[l_key] = 1
+        if l_verbose:
+            l_outLines.append('Heavy : {0:.3f} ms. --> {1}/{2}'.format((t1-t0)/1e6, l_brB, l_ptfB))
+            if len(l_outLines) >= 1000:
+                sys.stdout.write('\n'.join(l_outLines) + '\n')
+                l_outLines.clear()
+
+        l_results.append((l_brA, l_ptfA, l_brB, l_ptfB))
+
+    if len(l_outLines) > 0:
+        sys.stdout.write('\n'.join(l_outLines) + '\n')
+
+    # mismatch tallies, counted in one go each (Counter() counts an iterable in C)
+    l_misBrowser = collections.Counter(
+        l_brA + '/' + l_brB for l_brA, _, l_brB, _ in l_results if l_brA != l_brB and l_brA != 'Bot')
+    l_misBot = collections.Counter(
+        l_brA + '/' + l_brB for l_brA, _, l_brB, _ in l_results if l_brA != l_brB and l_brA == 'Bot')
+    l_misPlatform = collections.Counter(
+        l_ptfA + '/' + l_ptfB for _, l_ptfA, _, l_ptfB in l_results if l_ptfA != l_ptfB)
 
     print('----- Browsers ---------------------')
     printSortedDict(l_misBrowser)
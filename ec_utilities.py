@@ -8,14 +8,23 @@ from ec_app_param import *
 import logging
 import re
 import email
+import email.message
+import email.utils
 import datetime
 import time
-import pytz
 import smtplib
 import psycopg2.pool
 import psycopg2
 import psycopg2.extensions
+import psycopg2.extras
 import threading
+import queue
+import atexit
+import logging.handlers
+import csv
+import io
+import os
+import collections
 
 # -------------------------------------- Logging Set-up ----------------------------------------------------------------
 class EcLogger(logging.Logger):
@@ -26,6 +35,27 @@ class EcLogger(logging.Logger):
     #: static variable containing the root logger.
     cm_logger = None
 
+    #: `QueueListener <https://docs.python.org/3.5/library/logging.handlers.html#queuelistener>`_ feeding the
+    #: :any:`EcDbLogHandler`
+    cm_dbLogListener = None
+
+    #: The :any:`EcDbLogHandler` fed by :any:`cm_dbLogListener`
+    cm_dbLogHandler = None
+
+    #: `QueueListener <https://docs.python.org/3.5/library/logging.handlers.html#queuelistener>`_ feeding the
+    #: CSV log file handler
+    cm_fileLogListener = None
+
+    @classmethod
+    def stopDbLog(cls):
+        """
+        Stops the :any:`cm_dbLogListener` thread and writes the records it still holds (at exit). The explicit
+        flush is needed because the listener's stop sentinel is in the queue while the last records are handled,
+        so that :any:`EcDbLogHandler` does not see the end of the burst.
+        """
+        cls.cm_dbLogListener.stop()
+        cls.cm_dbLogHandler.flush()
+
     @classmethod
     def rootLogger(cls):
         """
@@ -57,11 +87,11 @@ class EcLogger(logging.Logger):
     @classmethod
     def logInit(cls):
         """
-        Initializes the logging system by creating the root logger + 2 subclasses of :py:class:`logging.Formatter`
-        to handle:
+        Initializes the logging system by creating the root logger + handlers for:
 
         * the in-console display of log messages.
         * their storage into a CSV file (path given in :any:`gcm_logFile`).
+        * the sending of a mail for each WARNING message or worse.
 
         Only INFO level messages and above are displayed on screen (if :any:`gcm_verboseModeOn` is set).
         DEBUG level messages, if any, are sent to the CSV file.
@@ -78,90 +108,74 @@ class EcLogger(logging.Logger):
         cls.cm_logger = logging.getLogger()
 
         # One handler for the console (only up to INFO messages) and another for the CSV file (everything)
+        # The CSV file handler is fed through a queue so that the file writes take place in the listener thread
+        # and not in the threads issuing the log messages
         l_handlerConsole = logging.StreamHandler()
-        l_handlerFile = logging.FileHandler(EcAppParam.gcm_logFile, mode='a')
+        l_fileQueue = queue.SimpleQueue()
+        l_handlerFileQueue = logging.handlers.QueueHandler(l_fileQueue)
+
+        # CSV file handler --> the file is not flushed after each record (one write() syscall per record) but only
+        # at the end of each burst of messages (queue empty) or for WARNING messages and above, so that they are
+        # on disk right away. The file buffer is enlarged accordingly
+        class EcCsvFileHandler(logging.FileHandler):
+            def _open(self):
+                return open(self.baseFilename, self.mode, buffering=64*1024, encoding=self.encoding,
+                            errors=self.errors)
+
+            def emit(self, p_record):
+                try:
+                    # re-opened if closed, as FileHandler.emit() does
+                    if self.stream is None:
+                        self.stream = self._open()
+                    self.stream.write(self.format(p_record) + self.terminator)
+                    if p_record.levelno >= logging.WARNING or l_fileQueue.empty():
+                        self.flush()
+                except Exception:
+                    self.handleError(p_record)
+
+        l_handlerFile = EcCsvFileHandler(EcAppParam.gcm_logFile, mode='a')
 
         # Custom Formatter for the CSV file --> eliminates multiple spaces (and \r\n)
         class EcCsvFormatter(logging.Formatter):
             def format(self, p_record):
-                l_record = logging.LogRecord(
-                    p_record.name,
-                    p_record.levelno,
-                    p_record.pathname,
-                    p_record.lineno,
-                    re.sub('"', '""', p_record.msg),
-                    # message arguments are not allowed here
-                    None,
-                    # p_record.args,
-                    p_record.exc_info,
-                    p_record.funcName,
-                    p_record.stack_info,
-                )
-
-                return re.sub('\s+', ' ', super().format(l_record))
-
-        # Custom Formatter for the console --> send mail if warning or worse
-        class EcConsoleFormatter(logging.Formatter):
-            def format(self, p_record):
-                l_formatted = super().format(p_record)
-
-                # this test is located here and not in the CSV formatter so that it does not get to be performed
-                # needlessly for every debug message
-                if p_record.levelno >= logging.WARNING:
-                    # send mail
+                # the record is temporarily modified rather than copied into a new LogRecord
+                l_msg, l_args = p_record.msg, p_record.args
+                try:
+                    # double quotes doubled (CSV) in the final message: the arguments, if any, are merged first by
+                    # getMessage() (the QueueHandler has already done it for the records coming from the queue) and
+                    # then removed, so that they are not applied a second time to the escaped message
+                    p_record.msg = p_record.getMessage().replace('"', '""')
+                    p_record.args = None
+                    l_formatted = super().format(p_record)
+                finally:
+                    p_record.msg, p_record.args = l_msg, l_args
+
+                # runs of white space (incl. \r\n) collapsed into a single space
+                return ' '.join(l_formatted.split())
+
+        # Handler sending a mail for each message (WARNING or worse, see below) The level filtering is done by the
+        # logging system, so that nothing more than the (plain) console formatting takes place for the other messages
+        # (the storage of these messages into TB_EC_MSG is handled by EcDbLogHandler, see below)
+        class EcMailHandler(logging.Handler):
+            def emit(self, p_record):
+                # send mail (only queued here, the SMTP exchange takes place in the mailer thread)
+                try:
                     EcMailer.sendMail(
                         '{0}-{1}[{2}]/{3}'.format(
                             p_record.levelname,
                             p_record.module,
                             p_record.lineno,
                             p_record.funcName),
-                        l_formatted
+                        self.format(p_record)
                     )
+                except Exception:
+                    self.handleError(p_record)
 
-                    # log message in TB_EC_MSG
-                    l_conn = psycopg2.connect(
-                        host=EcAppParam.gcm_dbServer,
-                        database=EcAppParam.gcm_dbDatabase,
-                        user=EcAppParam.gcm_dbUser,
-                        password=EcAppParam.gcm_dbPassword
-                    )
-                    l_cursor = l_conn.cursor()
-                    try:
-                        l_cursor.execute("""
-                            insert into "TB_EC_MSG"(
-                                "ST_NAME",
-                                "ST_LEVEL",
-                                "ST_MODULE",
-                                "ST_FILENAME",
-                                "ST_FUNCTION",
-                                "N_LINE",
-                                "TX_MSG"
-                            )
-                            values(%s, %s, %s, %s, %s, %s, %s);
-                        """, (
-                            p_record.name,
-                            p_record.levelname,
-                            p_record.module,
-                            p_record.pathname,
-                            p_record.funcName,
-                            p_record.lineno,
-                            re.sub('\s+', ' ', p_record.msg)
-                        ))
-                        l_conn.commit()
-                    except Exception as e:
-                        EcMailer.sendMail('TB_EC_MSG insert failure: {0}-{1}'.format(
-                            type(e).__name__,
-                            repr(e)
-                        ), 'Sent from EcConsoleFormatter')
-                        raise
-
-                    l_cursor.close()
-                    l_conn.close()
-
-                return l_formatted
+        l_handlerMail = EcMailHandler(logging.WARNING)
 
         # Install formatters
-        l_handlerConsole.setFormatter(EcConsoleFormatter('ECL:%(levelname)s:%(name)s:%(message)s'))
+        l_handlerConsole.setFormatter(logging.Formatter('ECL:%(levelname)s:%(name)s:%(message)s'))
+        l_handlerMail.setFormatter(logging.Formatter('ECL:%(levelname)s:%(name)s:%(message)s'))
         l_handlerFile.setFormatter(EcCsvFormatter('"%(name)s";"%(asctime)s";"%(levelname)s";"%(module)s";' +
                                                   '"%(filename)s";"%(funcName)s";%(lineno)d;"%(message)s"'))
 
@@ -169,22 +183,182 @@ class EcLogger(logging.Logger):
         if EcAppParam.gcm_verboseModeOn:
             cls.cm_logger.setLevel(logging.INFO)
             l_handlerConsole.setLevel(logging.INFO)
-            l_handlerFile.setLevel(logging.INFO)
+            l_handlerFileQueue.setLevel(logging.INFO)
 
         # If debug mode is on, then the console stays as it is but the CSV file now receives everything
         if EcAppParam.gcm_debugModeOn:
             cls.cm_logger.setLevel(logging.DEBUG)
-            l_handlerFile.setLevel(logging.DEBUG)
+            l_handlerFileQueue.setLevel(logging.DEBUG)
 
         # Install the handlers
         cls.cm_logger.addHandler(l_handlerConsole)
-        cls.cm_logger.addHandler(l_handlerFile)
+        cls.cm_logger.addHandler(l_handlerFileQueue)
+        cls.cm_logger.addHandler(l_handlerMail)
+
+        cls.cm_fileLogListener = logging.handlers.QueueListener(l_fileQueue, l_handlerFile)
+        cls.cm_fileLogListener.start()
+        # so that the records still in the queue are written at exit
+        atexit.register(cls.cm_fileLogListener.stop)
+
+        # WARNING messages and above are also stored in TB_EC_MSG. The logging threads only put the records into
+        # a queue and the DB writes take place in the listener thread, in batches (see EcDbLogHandler)
+        l_dbQueue = queue.SimpleQueue()
+        l_handlerQueue = logging.handlers.QueueHandler(l_dbQueue)
+        l_handlerQueue.setLevel(logging.WARNING)
+        cls.cm_logger.addHandler(l_handlerQueue)
+
+        cls.cm_dbLogHandler = EcDbLogHandler(l_dbQueue)
+        cls.cm_dbLogListener = logging.handlers.QueueListener(l_dbQueue, cls.cm_dbLogHandler)
+        cls.cm_dbLogListener.start()
+        # so that the records still in the queue are written at exit (registered after EcMailer.initMailer() -->
+        # called before the mailer is stopped, so that a failure can still be reported by mail)
+        atexit.register(cls.stopDbLog)
 
         # Start-up Messages
         cls.cm_logger.info('-->> Start logging')
         cls.cm_logger.debug('-->> Start logging')
 
 
+# -------------------------------------- Log messages storage in TB_EC_MSG ---------------------------------------------
+class EcDbLogHandler(logging.Handler):
+    """
+    Logging handler storing log records into `TB_EC_MSG`. It is fed by a
+    `QueueListener <https://docs.python.org/3.5/library/logging.handlers.html#queuelistener>`_ (see
+    :any:`EcLogger.logInit`) so that the DB writes do not take place in the threads issuing the log messages.
+
+    Records are accumulated and written together (see :any:`EcDbLogHandler.insertRows`) when either
+    :any:`cm_batchSize` records are waiting or the queue is empty (i.e. at the end of each burst of messages)
+    """
+
+    #: SQL statement used to store one message row into `TB_EC_MSG` (see :any:`EcDbLogHandler.insertRows`)
+    cm_insertMsg = """
+        insert into "TB_EC_MSG"(
+            "ST_NAME",
+            "ST_LEVEL",
+            "ST_MODULE",
+            "ST_FILENAME",
+            "ST_FUNCTION",
+            "N_LINE",
+            "TX_MSG"
+        )
+        values(%s, %s, %s, %s, %s, %s, %s);
+    """
+
+    #: SQL statement used to bulk load message rows into `TB_EC_MSG` (see :any:`EcDbLogHandler.insertRows`)
+    cm_copyMsg = """
+        copy "TB_EC_MSG"(
+            "ST_NAME",
+            "ST_LEVEL",
+            "ST_MODULE",
+            "ST_FILENAME",
+            "ST_FUNCTION",
+            "N_LINE",
+            "TX_MSG"
+        )
+        from stdin with (format csv);
+    """
+
+    #: Max number of records written together
+    cm_batchSize = 200
+
+    #: Above this number of rows, :any:`EcDbLogHandler.insertRows` uses `COPY` instead of `INSERT` statements
+    cm_copyThreshold = 50
+
+    @classmethod
+    def insertRows(cls, p_conn, p_rows):
+        """
+        Writes a list of message rows to `TB_EC_MSG` in one go, through
+        `execute_batch <http://initd.org/psycopg/docs/extras.html#fast-execution-helpers>`_. The page size is
+        the size of the whole list so that all the statements are pipelined in a single server round-trip
+        (psycopg2 equivalent of libpq pipeline mode)
+
+        Above :any:`cm_copyThreshold` rows, the rows are formatted as CSV into an in-memory buffer and loaded with
+        `copy_expert <http://initd.org/psycopg/docs/cursor.html#cursor.copy_expert>`_ instead, which bypasses the
+        parsing/planning of one `INSERT` per row.
+
+        :param p_conn: The DB connection to use.
+        :param p_rows: List of 7-tuples (name, level, module, file name, function, line, message)
+        """
+        l_cursor = p_conn.cursor()
+        if len(p_rows) > cls.cm_copyThreshold:
+            l_buffer = io.StringIO()
+            # all strings quoted, so that empty strings are not loaded as NULLs
+            csv.writer(l_buffer, quoting=csv.QUOTE_NONNUMERIC, lineterminator='\n').writerows(p_rows)
+            l_buffer.seek(0)
+            l_cursor.copy_expert(cls.cm_copyMsg, l_buffer)
+        else:
+            psycopg2.extras.execute_batch(l_cursor, cls.cm_insertMsg, p_rows, page_size=len(p_rows))
+        p_conn.commit()
+        l_cursor.close()
+
+    def __init__(self, p_queue):
+        """
+        :param p_queue: the queue the handler is fed from (to know when a burst of messages is over)
+        """
+        super().__init__()
+        self.m_queue = p_queue
+        self.m_rows = []
+
+        #: DB connection, opened at the first write and kept (re-opened after an error)
+        self.m_conn = None
+
+    def emit(self, p_record):
+        try:
+            self.m_rows.append((
+                p_record.name,
+                p_record.levelname,
+                p_record.module,
+                p_record.pathname,
+                p_record.funcName,
+                p_record.lineno,
+                ' '.join(p_record.getMessage().split())
+            ))
+
+            if len(self.m_rows) >= EcDbLogHandler.cm_batchSize or self.m_queue.empty():
+                self.flush()
+        except Exception:
+            self.handleError(p_record)
+
+    def flush(self):
+        if len(self.m_rows) == 0:
+            return
+
+        l_rows = self.m_rows
+        self.m_rows = []
+        try:
+            if self.m_conn is None:
+                self.m_conn = psycopg2.connect(
+                    host=EcAppParam.gcm_dbServer,
+                    database=EcAppParam.gcm_dbDatabase,
+                    user=EcAppParam.gcm_dbUser,
+                    password=EcAppParam.gcm_dbPassword
+                )
+            try:
+                EcDbLogHandler.insertRows(self.m_conn, l_rows)
+            except Exception:
+                # state of the connection unknown --> not reused
+                self.closeConnection()
+                raise
+        except Exception as e:
+            # not raised, otherwise the listener thread would die
+            EcMailer.sendMail('TB_EC_MSG insert failure: {0}-{1}'.format(
+                type(e).__name__,
+                repr(e)
+            ), 'Sent from EcDbLogHandler ({0} messages lost)'.format(len(l_rows)))
+
+    def closeConnection(self):
+        if self.m_conn is not None:
+            try:
+                self.m_conn.close()
+            except Exception:
+                pass
+            self.m_conn = None
+
+    def close(self):
+        self.flush()
+        self.closeConnection()
+        super().close()
+
 # -------------------------------------- e-mail messages sending -------------------------------------------------------
 class EcMailer(threading.Thread):
     """
@@ -204,32 +378,118 @@ class EcMailer(threading.Thread):
     `this page <http://stackabuse.com/how-to-send-emails-with-gmail-using-python/>`_
     """
 
-    #: List of previously sent messages with timestamps, to avoid sending too many (min. 5min. deep).
+    #: Subject --> timestamps of the previously sent messages (deque, oldest first), to avoid sending too many
+    #: (5min. deep). Only accessed from the mailer thread (see :any:`sendBatch`) --> no lock needed
     cm_sendMailGovernor = None
 
-    #: Concurrency management lock to control access to :any:`cm_sendMailGovernor` This is necessary
-    #: because each mail sending operation is executed asynchronously in its own thread
-    cm_mutexGovernor = None
-
-    #: Concurrency management lock to control access to the log files (see :any:`sendMail`). This is necessary
-    #: because each mail sending operation is executed asynchronously in its own thread
+    #: Concurrency management lock to control access to the log files (see :any:`sendMail`), written to by the
+    #: mailer thread and at exit
     cm_mutexFiles = None
 
+    #: SMTP connection (`smtplib.SMTP`), opened by the first message and kept open for the next ones (TLS and
+    #: authentication only take place once). `None` when not connected
+    cm_smtp = None
+
+    #: Concurrency management lock to control access to :any:`cm_smtp`
+    cm_mutexSmtp = None
+
+    #: Mail log files (see :any:`sendMail`) file descriptors, opened once by :any:`initMailer` and kept open (append
+    #: mode): all sent messages, messages not sent because of the governor limit, messages rejected by the SMTP
+    #: server and SMTP error records
+    cm_fAllMsg = None
+    cm_fOverflowMsg = None
+    cm_fRejectedMsg = None
+    cm_fSmtpError = None
+
+    #: Queue of the (subject, message) tuples waiting to be sent by the mailer thread (see :any:`sendMail`)
+    cm_mailQueue = None
+
+    #: The mailer thread (see :any:`EcMailer.run`)
+    cm_worker = None
+
+    #: Time (seconds) during which queued messages are collected into a batch, after the first one
+    cm_batchDelay = 0.5
+
+    #: Max number of messages in a batch
+    cm_batchMax = 32
+
+    #: UNIX time (whole seconds) of the cached date strings below (see :any:`mailDates`)
+    cm_dateSecond = None
+
+    #: Cached RFC 2822 date (mail `Date` header) for :any:`cm_dateSecond`
+    cm_dateRfc = None
+
+    #: Cached date in the CSV log file format for :any:`cm_dateSecond`
+    cm_dateCsv = None
+
+    #: Extension of :any:`EcAppParam.gcm_logFile`, replaced to obtain the paths of the mail log files
+    cm_reCsvExt = re.compile(r'\.csv')
+
     @classmethod
     def initMailer(cls):
         """
-        Mail system intialization. Creates an empty :any:`cm_sendMailGovernor` and the associated
-        Mutexes to allow critical section protection.
+        Mail system intialization. Creates an empty :any:`cm_sendMailGovernor`, the mutexes protecting the
+        log files and the SMTP connection, and starts the mailer thread.
         """
-        cls.cm_sendMailGovernor = dict()
-        cls.cm_mutexGovernor = threading.Lock()
+        cls.cm_sendMailGovernor = collections.defaultdict(collections.deque)
         cls.cm_mutexFiles = threading.Lock()
+        cls.cm_smtp = None
+        cls.cm_mutexSmtp = threading.Lock()
+        atexit.register(cls.closeSmtpAtExit)
+
+        # the mail log files are opened once here rather than for each message (open/close syscalls per mail)
+        # Raw file descriptors: the texts are written with os.write() (see appendToFiles()), without any Python
+        # file object buffering
+        l_flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+        cls.cm_fAllMsg = os.open(cls.cm_reCsvExt.sub('.all_msg', EcAppParam.gcm_logFile), l_flags, 0o644)
+        cls.cm_fOverflowMsg = os.open(cls.cm_reCsvExt.sub('.overflow_msg', EcAppParam.gcm_logFile), l_flags, 0o644)
+        cls.cm_fRejectedMsg = os.open(cls.cm_reCsvExt.sub('.rejected_msg', EcAppParam.gcm_logFile), l_flags, 0o644)
+        cls.cm_fSmtpError = os.open(cls.cm_reCsvExt.sub('.smtp_error', EcAppParam.gcm_logFile), l_flags, 0o644)
+        atexit.register(cls.closeFiles)
+
+        # the mailer thread. Its stop is registered last so that it takes place first (atexit functions are called
+        # in reverse order): the queued messages are sent before the files and the SMTP connection are closed
+        cls.cm_mailQueue = queue.SimpleQueue()
+        cls.cm_worker = EcMailer()
+        cls.cm_worker.start()
+        atexit.register(cls.stopMailer)
+
+    @classmethod
+    def closeFiles(cls):
+        """
+        Closes the mail log files opened by :any:`initMailer` (at exit). Left open if the mailer thread is still
+        running (stuck SMTP exchange, see :any:`stopMailer`) since it may still write to them.
+        """
+        if cls.cm_worker is not None and cls.cm_worker.is_alive():
+            return
+
+        with cls.cm_mutexFiles:
+            for l_fd in (cls.cm_fAllMsg, cls.cm_fOverflowMsg, cls.cm_fRejectedMsg, cls.cm_fSmtpError):
+                os.close(l_fd)
+
+    @classmethod
+    def appendToFiles(cls, *p_writes):
+        """
+        Appends text to one or more of the mail log files, in a single critical section. Each text is encoded
+        beforehand and written with one `write()` syscall so that the file content is complete even if the process
+        dies.
+
+        :param p_writes: (file descriptor, text) pairs
+        """
+        with cls.cm_mutexFiles:
+            for l_fd, l_text in p_writes:
+                l_data = l_text.encode('utf-8')
+                # (partial writes are only possible in exceptional cases, e.g. disk full)
+                while len(l_data) > 0:
+                    l_data = l_data[os.write(l_fd, l_data):]
 
     @classmethod
     def sendMail(cls, p_subject, p_message):
         """
-        Sends an e-mail message asynchronously (each call executed in its own thread) to avoid
-        blocking the main application flow while waiting for the SMTP server to respond.
+        Sends an e-mail message asynchronously to avoid blocking the main application flow while waiting for the
+        SMTP server to respond: the message is only queued here. The mailer thread (started by :any:`initMailer`)
+        sends the queued messages in batches (see :any:`EcMailer.run`): messages queued within
+        :any:`cm_batchDelay` of each other and having the same subject are sent as a single e-mail.
 
         Every sent message goes into a text file
         (same path as :any:`EcAppParam.gcm_logFile` but with 'all_msg' at the end instead of 'csv')
@@ -245,171 +505,288 @@ class EcMailer(threading.Thread):
         :any:`EcAppParam.gcm_logFile` but with 'rejected_msg' at the end instead of 'csv')
 
         All these files are appended to only (open mode ``'a'``) Nothing is ever removed from them. Any
-        write access to them is protected by a mutex because of the asynchronous nature of the operations (several
-        e-mail messages may be in the process of being sent in parallel)
+        write access to them is protected by a mutex.
 
         :param p_subject: Message subject.
         :param p_message: Message body.
         """
-        l_thread = EcMailer(p_subject, p_message)
-        l_thread.start()
+        cls.cm_mailQueue.put((p_subject, p_message))
 
-    def __init__(self, p_subject, p_message):
+    @classmethod
+    def stopMailer(cls):
+        """
+        Stops the mailer thread once the messages already queued have been sent (at exit).
         """
-        preparing the thread to be launched (by :any:`sendMail`)
+        cls.cm_mailQueue.put(None)
+        cls.cm_worker.join(timeout=60)
 
-        :param p_subject: same as in :any:`sendMail`
-        :param p_message: same as in :any:`sendMail`
+    def __init__(self):
         """
-        self.m_subject = p_subject
-        self.m_message = p_message
+        The mailer thread (a single one, started by :any:`initMailer`)
+        """
+        super().__init__(name='EcMailer', daemon=True)
 
-        super().__init__()
+        #: numeric value indicating the steps in the authentication process, for debug purposes
+        self.m_stepPassed = 0
 
-    def run(self):
+    def connectSmtp(self):
         """
-        Actual e-mail sending process (executed in a dedicated thread)
+        Opens the SMTP connection kept in :any:`cm_smtp` (TLS + authentication for Amazon SES and Gmail). The
+        progress is tracked in `m_stepPassed` (reported in the SMTP error records). Must be called with
+        :any:`cm_mutexSmtp` held.
         """
+        if EcAppParam.gcm_amazonSmtp:
+            # Amazon AWS/SES
+
+            # smtp client init
+            l_smtpObj = smtplib.SMTP(
+                host=EcAppParam.gcm_smtpServer,
+                port=587,
+                timeout=10)
+            self.m_stepPassed = 101
+
+            # initialize TLS connection
+            l_smtpObj.starttls()
+            self.m_stepPassed = 102
+            l_smtpObj.ehlo()
+            self.m_stepPassed = 103
+
+            # authentication
+            l_smtpObj.login(EcAppParam.gcm_sesUserName, EcAppParam.gcm_sesPassword)
+            self.m_stepPassed = 104
+        elif EcAppParam.gcm_gmailSmtp:
+            # Gmail / TLS authentication
+
+            # smtp client init
+            l_smtpObj = smtplib.SMTP(EcAppParam.gcm_smtpServer, 587, timeout=10)
+            self.m_stepPassed = 201
+
+            # initialize TLS connection
+            l_smtpObj.starttls()
+            self.m_stepPassed = 202
+            l_smtpObj.ehlo()
+            self.m_stepPassed = 203
+
+            # authentication
+            l_smtpObj.login(EcAppParam.gcm_mailSender, EcAppParam.gcm_mailSenderPassword)
+            self.m_stepPassed = 204
+        else:
+            l_smtpObj = smtplib.SMTP(EcAppParam.gcm_smtpServer, timeout=10)
 
-        # message context with headers and body
-        l_message = """From: {0}
-            To: {1}
-            Date: {2}
-            Subject: {3}
+        EcMailer.cm_smtp = l_smtpObj
 
-            {4}
-        """.format(
-            EcAppParam.gcm_mailSender,
-            ', '.join(EcAppParam.gcm_mailRecipients),
-            email.utils.format_datetime(datetime.datetime.now(tz=pytz.utc)),
-            self.m_subject,
-            self.m_message
-        )
+    @classmethod
+    def closeSmtp(cls, p_quit=False):
+        """
+        Closes the SMTP connection kept in :any:`cm_smtp`, if any. Must be called with :any:`cm_mutexSmtp` held.
 
-        # removes spaces at the begining of lines
-        l_message = re.sub('^[ \t\r\f\v]+', '', l_message, flags=re.MULTILINE)
+        :param p_quit: If `True`, the SMTP session is ended properly (`QUIT` command) before the connection is
+            closed. Otherwise (connection in error) it is just closed.
+        """
+        if cls.cm_smtp is None:
+            return
 
-        # limitation of email sent
-        EcMailer.cm_mutexGovernor.acquire()
-        #### cm_sendMailGovernor CRITICAL SECTION START ######
-        l_now = time.time()
         try:
-            # the list of all UNIX timestamps when this subject was sent in the previous 5 min at least
-            l_thisSubjectHistory = EcMailer.cm_sendMailGovernor[self.m_subject]
-        except KeyError:
-            l_thisSubjectHistory = [l_now]
+            if p_quit:
+                cls.cm_smtp.quit()
+            else:
+                cls.cm_smtp.close()
+        except Exception:
+            cls.cm_smtp.close()
+        cls.cm_smtp = None
+
+    @classmethod
+    def closeSmtpAtExit(cls):
+        """
+        Ends the kept SMTP session (at exit). Skipped if the mailer thread is still running (it holds
+        :any:`cm_mutexSmtp` while stuck in an SMTP exchange)
+        """
+        if cls.cm_worker is not None and cls.cm_worker.is_alive():
+            return
+
+        with cls.cm_mutexSmtp:
+            cls.closeSmtp(p_quit=True)
+
+    def run(self):
+        """
+        Mailer thread loop: waits for a message to be queued (see :any:`sendMail`), collects the other messages
+        queued within :any:`cm_batchDelay` (at most :any:`cm_batchMax`) and sends them (see :any:`sendBatch`),
+        until :any:`stopMailer` is called.
+        """
+        # looked up once, not at each message
+        l_get = EcMailer.cm_mailQueue.get
+        l_batchDelay = EcMailer.cm_batchDelay
+        l_batchMax = EcMailer.cm_batchMax
+        while True:
+            l_batch = [l_get()]
+            l_deadline = time.monotonic() + l_batchDelay
+            while l_batch[-1] is not None and len(l_batch) < l_batchMax:
+                l_wait = l_deadline - time.monotonic()
+                if l_wait <= 0:
+                    break
+                try:
+                    l_batch.append(l_get(timeout=l_wait))
+                except queue.Empty:
+                    break
+
+            # None --> stop request from stopMailer()
+            l_stop = l_batch[-1] is None
+            if l_stop:
+                l_batch.pop()
+
+            try:
+                self.sendBatch(l_batch)
+            except Exception as e:
+                # not raised, otherwise the mailer thread would die
+                EcMailer.appendToFiles(
+                    (EcMailer.cm_fAllMsg,
+                     '!!!!! {0}-"{1}" [Batch]\n'.format(type(e).__name__, ' '.join(repr(e).split())))
+                )
+
+            if l_stop:
+                return
+
+    def sendBatch(self, p_batch):
+        """
+        Sends a batch of queued messages: one e-mail per subject, its body made of the messages having this subject
+        (in queuing order), unless the governor limit has been reached (see :any:`sendMail`).
+
+        :param p_batch: list of (subject, message) tuples
+        """
+        l_bySubject = dict()
+        for l_subject, l_message in p_batch:
+            l_bySubject.setdefault(l_subject, []).append(l_message)
+
+        l_governorCount = EcMailer.governorCount
+        for l_subject, l_messageList in l_bySubject.items():
+            l_sendList = []
+            for l_message in l_messageList:
+                # maximum : 10 with the same subject every 5 minutes
+                if l_governorCount(l_subject) > 10:
+                    # overflow stored the message in a separate file
+                    EcMailer.appendToFiles(
+                        (EcMailer.cm_fOverflowMsg, '>>>>>>>\n' + EcMailer.composeMail(l_subject, l_message)[1]))
+                else:
+                    l_sendList.append(l_message)
+
+            if len(l_sendList) > 0:
+                self.sendOne(l_subject, '\n\n'.join(l_sendList))
 
+    @classmethod
+    def governorCount(cls, p_subject):
+        """
+        Records a sending of a message with the given subject in :any:`cm_sendMailGovernor`.
+
+        :param p_subject: Message subject.
+        :return: The number of messages with this subject in the last 5 minutes (including this one)
+        """
+        l_now = time.time()
+        # all UNIX timestamps when this subject was sent in the previous 5 min, oldest first --> the expired ones
+        # are dropped from the left
+        l_thisSubjectHistory = cls.cm_sendMailGovernor[p_subject]
         l_thisSubjectHistory.append(l_now)
+        while l_now - l_thisSubjectHistory[0] >= 5*60:
+            l_thisSubjectHistory.popleft()
+        return len(l_thisSubjectHistory)
 
-        l_thisSubjectHistoryNew = list()
-        l_count = 0
-        for l_pastsend in l_thisSubjectHistory:
-            if l_now - l_pastsend < 5*60:
-                l_count += 1
-                l_thisSubjectHistoryNew.append(l_pastsend)
-
-        EcMailer.cm_sendMailGovernor[self.m_subject] = l_thisSubjectHistoryNew
-        #### cm_sendMailGovernor CRITICAL SECTION END ######
-        EcMailer.cm_mutexGovernor.release()
-
-        # maximum : 10 with the same subject every 5 minutes
-        if l_count > 10:
-            # overflow stored the message in a separate file
-            EcMailer.cm_mutexFiles.acquire()
-            l_fLog = open(re.sub('\.csv', '.overflow_msg', EcAppParam.gcm_logFile), 'a')
-            l_fLog.write('>>>>>>>\n' + l_message)
-            l_fLog.close()
-            EcMailer.cm_mutexFiles.release()
-            return
+    @classmethod
+    def mailDates(cls):
+        """
+        Current date formatted for the mail `Date` header and for the CSV error records. The strings are only
+        computed once per second (all the mails of a batch are sent within the same second or so) Only called from
+        the mailer thread --> no lock needed.
+
+        :return: A tuple (RFC 2822 date, CSV log date)
+        """
+        l_second = int(time.time())
+        if l_second != cls.cm_dateSecond:
+            l_now = datetime.datetime.fromtimestamp(l_second, tz=datetime.timezone.utc)
+            cls.cm_dateRfc = email.utils.format_datetime(l_now)
+            cls.cm_dateCsv = l_now.strftime('%Y-%m-%d %H:%M.%S')
+            cls.cm_dateSecond = l_second
+        return cls.cm_dateRfc, cls.cm_dateCsv
+
+    @staticmethod
+    def composeMail(p_subject, p_message):
+        """
+        :param p_subject: Message subject.
+        :param p_message: Message body.
+        :return: A tuple (:any:`email.message.EmailMessage`, readable text version for the mail log files)
+        """
+        # message headers and body (no indentation to scrub, and the body is left as it is)
+        l_email = email.message.EmailMessage()
+        l_email['From'] = EcAppParam.gcm_mailSender
+        l_email['To'] = ', '.join(EcAppParam.gcm_mailRecipients)
+        l_email['Date'] = EcMailer.mailDates()[0]
+        # (header values cannot contain line breaks)
+        l_email['Subject'] = ' '.join(p_subject.split())
+        l_email.set_content(p_message)
+
+        # readable version, for the mail log files (headers + body as is, even if the body has to be encoded for
+        # transmission)
+        l_text = ''.join('{0}: {1}\n'.format(l_header, l_value) for l_header, l_value in l_email.items()) + \
+            '\n' + p_message + '\n'
+
+        return l_email, l_text
+
+    def sendOne(self, p_subject, p_message):
+        """
+        Actual e-mail sending process, through the kept SMTP connection (see :any:`connectSmtp`)
+
+        :param p_subject: Message subject.
+        :param p_message: Message body.
+        """
+        l_email, l_message = EcMailer.composeMail(p_subject, p_message)
 
         # all messages
-        l_fLogName = re.sub('\.csv', '.all_msg', EcAppParam.gcm_logFile)
-        EcMailer.cm_mutexFiles.acquire()
-        l_fLog = open(l_fLogName, 'a')
-        l_fLog.write('>>>>>>>\n' + l_message)
-        l_fLog.close()
-        EcMailer.cm_mutexFiles.release()
+        EcMailer.appendToFiles((EcMailer.cm_fAllMsg, '>>>>>>>\n' + l_message))
 
-        # numeric value indicating the steps in the authentication process, for debug purposes
-        l_stepPassed = 0
+        self.m_stepPassed = 0
         try:
-            if EcAppParam.gcm_amazonSmtp:
-                # Amazon AWS/SES
-
-                # smtp client init
-                l_smtpObj = smtplib.SMTP(
-                    host=EcAppParam.gcm_smtpServer,
-                    port=587,
-                    timeout=10)
-                l_stepPassed = 101
-
-                # initialize TLS connection
-                l_smtpObj.starttls()
-                l_stepPassed = 102
-                l_smtpObj.ehlo()
-                l_stepPassed = 103
-
-                # authentication
-                l_smtpObj.login(EcAppParam.gcm_sesUserName, EcAppParam.gcm_sesPassword)
-                l_stepPassed = 104
-            elif EcAppParam.gcm_gmailSmtp:
-                # Gmail / TLS authentication
-
-                # smtp client init
-                l_smtpObj = smtplib.SMTP(EcAppParam.gcm_smtpServer, 587)
-                l_stepPassed = 201
-
-                # initialize TLS connection
-                l_smtpObj.starttls()
-                l_stepPassed = 202
-                l_smtpObj.ehlo()
-                l_stepPassed = 203
-
-                # authentication
-                l_smtpObj.login(EcAppParam.gcm_mailSender, EcAppParam.gcm_mailSenderPassword)
-                l_stepPassed = 204
-            else:
-                l_smtpObj = smtplib.SMTP(EcAppParam.gcm_smtpServer)
+            # (the lock guards against the exit-time QUIT, see closeSmtpAtExit())
+            with EcMailer.cm_mutexSmtp:
+                try:
+                    if EcMailer.cm_smtp is None:
+                        self.connectSmtp()
 
-            # sending message
-            l_smtpObj.sendmail(EcAppParam.gcm_mailSender, EcAppParam.gcm_mailRecipients, l_message)
-            l_stepPassed = 99
-
-            # end TLS session (Amazon SES / Gmail)
-            if EcAppParam.gcm_amazonSmtp or EcAppParam.gcm_gmailSmtp:
-                l_smtpObj.quit()
+                    # sending message
+                    try:
+                        EcMailer.cm_smtp.send_message(
+                            l_email, EcAppParam.gcm_mailSender, EcAppParam.gcm_mailRecipients)
+                    except smtplib.SMTPServerDisconnected:
+                        # the kept connection was closed by the server (idle timeout) --> reconnect, once
+                        EcMailer.closeSmtp()
+                        self.connectSmtp()
+                        EcMailer.cm_smtp.send_message(
+                            l_email, EcAppParam.gcm_mailSender, EcAppParam.gcm_mailRecipients)
+                    self.m_stepPassed = 99
+                except Exception:
+                    # state of the connection unknown --> not reused
+                    EcMailer.closeSmtp()
+                    raise
         except smtplib.SMTPException as l_exception:
             # if failure, stores the message in a separate file
-            EcMailer.cm_mutexFiles.acquire()
-            l_fLog = open(re.sub('\.csv', '.rejected_msg', EcAppParam.gcm_logFile), 'a')
-            l_fLog.write('>>>>>>>\n' + l_message)
-            l_fLog.close()
-
             # and create a log record in another separate file (distinct from the main log file)
-            l_fLog = open(re.sub('\.csv', '.smtp_error', EcAppParam.gcm_logFile), 'a')
-            # LOGGER_NAME;TIME;LEVEL;MODULE;FILE;FUNCTION;LINE;MESSAGE
-            l_fLog.write(
-                'EcMailer;{0};CRITICAL;ec_utilities;ec_utilities.py;sendMail;0;{1}-{2} [step = {3}]\n'.format(
-                    datetime.datetime.now(tz=pytz.utc).strftime('%Y-%m-%d %H:%M.%S'),
-                    type(l_exception).__name__,
-                    re.sub('\s+', ' ', repr(l_exception)),
-                    l_stepPassed
-                )
+            EcMailer.appendToFiles(
+                (EcMailer.cm_fRejectedMsg, '>>>>>>>\n' + l_message),
+                # LOGGER_NAME;TIME;LEVEL;MODULE;FILE;FUNCTION;LINE;MESSAGE
+                (EcMailer.cm_fSmtpError,
+                 'EcMailer;{0};CRITICAL;ec_utilities;ec_utilities.py;sendMail;0;{1}-{2} [step = {3}]\n'.format(
+                     EcMailer.mailDates()[1],
+                     type(l_exception).__name__,
+                     ' '.join(repr(l_exception).split()),
+                     self.m_stepPassed
+                 ))
             )
-            l_fLog.close()
-            EcMailer.cm_mutexFiles.release()
         except Exception as e:
-            EcMailer.cm_mutexFiles.acquire()
-            l_fLog = open(l_fLogName, 'a')
-            l_fLog.write(
-                '!!!!! {0}-"{1}" [Step = {2}]\n'.format(
-                    type(e).__name__,
-                    re.sub('\s+', ' ', repr(e)),
-                    l_stepPassed
-                )
+            EcMailer.appendToFiles(
+                (EcMailer.cm_fAllMsg,
+                 '!!!!! {0}-"{1}" [Step = {2}]\n'.format(
+                     type(e).__name__,
+                     ' '.join(repr(e).split()),
+                     self.m_stepPassed
+                 ))
             )
-            l_fLog.close()
-            EcMailer.cm_mutexFiles.release()
 
 
 # ----------------- Database connection pool ---------------------------------------------------------------------------
@@ -476,10 +853,13 @@ class EcConnectionPool(psycopg2.pool.ThreadedConnectionPool):
         :param p_key: parameter of the parent class method.
         :return: a connection from the pool, wrapped as an :any:`EcConnection`
         """
-        self.m_getCalls += 1
         l_newConn = super().getconn(p_key)
         l_newConn.debugData = p_debugData
-        self.m_connectionRegister.append(l_newConn)
+
+        # the register is shared by all threads --> protected by the pool lock (see connectionReport())
+        with self._lock:
+            self.m_getCalls += 1
+            self.m_connectionRegister.append(l_newConn)
 
         return l_newConn
 
@@ -501,8 +881,9 @@ class EcConnectionPool(psycopg2.pool.ThreadedConnectionPool):
         # It works fine and it matches the method signature given by the autocomplete.
         # For getconn, it is normal (added p_debugData) but not here.
 
-        self.m_putCalls += 1
-        self.m_connectionRegister.remove(p_conn)
+        with self._lock:
+            self.m_putCalls += 1
+            self.m_connectionRegister.remove(p_conn)
         p_conn.resetDebugData()
 
         super().putconn(p_conn, p_key, p_close)
@@ -510,20 +891,25 @@ class EcConnectionPool(psycopg2.pool.ThreadedConnectionPool):
     def closeall(self):
         super().closeall()
 
-    def connectionReport(self):
+    def connectionReport(self, p_timestamp=True):
         """
         Uses the debug data contained in all outstanding connections (listed in `m_connectionRegister`)
         to produce a report string (1 connection per line).
 
+        The pool lock is held (once) for the whole report, so that it is a consistent snapshot of the register.
+
+        :param p_timestamp: If `False`, the report does not start with the current date/time (so that two reports
+            can be compared to find out whether anything changed in between)
         :return: The report string.
         """
-        l_report = '[{0}] get/put: {1}/{2}\n'.format(
-            datetime.datetime.now(tz=pytz.utc),
-            self.m_getCalls, self.m_putCalls
-        )
+        with self._lock:
+            l_lines = ['get/put: {0}/{1}'.format(self.m_getCalls, self.m_putCalls)]
+            for l_conn in self.m_connectionRegister:
+                l_lines.append(l_conn.debugData)
 
-        for l_conn in self.m_connectionRegister:
-            l_report += l_conn.debugData + '\n'
+        l_report = '\n'.join(l_lines) + '\n'
+        if p_timestamp:
+            l_report = '[{0}] '.format(datetime.datetime.now(tz=datetime.timezone.utc)) + l_report
 
         return l_report
 
@@ -551,7 +937,7 @@ class EcConnection(psycopg2.extensions.connection):
         :param more:  parameter of the parent constructor.
         """
         self.m_debugData = 'Fresh'
-        self.m_creationDate = datetime.datetime.now(tz=pytz.utc)
+        self.m_creationDate = datetime.datetime.now(tz=datetime.timezone.utc)
         self.m_connectionID = EcConnection.cm_IDCounter
         EcConnection.cm_IDCounter += 1
 